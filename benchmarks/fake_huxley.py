@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import random
+import time
+import zlib
+from dataclasses import dataclass
+from fastapi import FastAPI, HTTPException
+
+OPERATORS = ("Northern", "TransPennine Express", "LNER", "CrossCountry", "Grand Central")
+ORIGINS = (
+    ("MAN", "Manchester Piccadilly"), ("YRK", "York"), ("KGX", "London Kings Cross"),
+    ("BHM", "Birmingham New Street"), ("NCL", "Newcastle"), ("HUL", "Hull"), ("SHF", "Sheffield")
+)
+DELAY_REASONS = ("A fault with the signalling system", "Overcrowding", "A late running freight train")
+
+# Shape of the boards and the failures a run should see
+@dataclass
+class FakeConfig:
+    latency: float = 0.05
+    jitter: float = 0.02
+    trains: int = 50
+    cancel_ratio: float = 0.05
+    delay_ratio: float = 0.2
+    error_rate: float = 0.0
+    # Boards change every `refresh` seconds, like Darwin updates
+    refresh: float = 30.0
+    seed: int = 1
+
+def _hhmm(minute):
+    minute %= 1440
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+def make_board(station, trains=50, cancel_ratio=0.05, delay_ratio=0.2, rng=None):
+    # A Huxley /all/ response with the fields rail_service.parse_board reads
+    rng = rng or random.Random(station)
+    start = rng.randrange(1440)
+    services = []
+    for i in range(trains):
+        crs, name = rng.choice(ORIGINS)
+        scheduled = start + i * 3
+        roll = rng.random()
+        if roll < cancel_ratio:
+            estimated = "Cancelled"
+        elif roll < cancel_ratio + delay_ratio:
+            estimated = _hhmm(scheduled + rng.randint(1, 45))
+        else:
+            estimated = "On time"
+        service = {
+            "origin": [{"crs": crs, "locationName": name}],
+            "platform": str(rng.randint(1, 17)),
+            "operator": rng.choice(OPERATORS),
+            "length": rng.choice((0, 2, 3, 4, 6, 8)),
+            "delayReason": rng.choice(DELAY_REASONS) if estimated != "On time" else None,
+            "serviceId": f"{station}{i:04d}",
+        }
+        # Starting services only carry departure times
+        if i % 5 == 0:
+            service.update(std=_hhmm(scheduled), etd=estimated)
+        else:
+            service.update(sta=_hhmm(scheduled), eta=estimated)
+        services.append(service)
+    return {"locationName": f"Station {station}", "crs": station, "trainServices": services}
+
+def create_app(config=None):
+    config = config or FakeConfig()
+    app = FastAPI(title="Fake Huxley")
+    app.state.config = config
+    app.state.requests = 0
+
+    @app.get("/all/{station}/{rows}")
+    async def board(station: str, rows: int):
+        cfg = app.state.config
+        app.state.requests += 1
+        delay = cfg.latency + random.uniform(-cfg.jitter, cfg.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if random.random() < cfg.error_rate:
+            raise HTTPException(status_code=503, detail="Fake upstream failure")
+        # Same station and refresh period -> same board, so ETags behave as in production
+        epoch = int(time.time() // cfg.refresh) if cfg.refresh else 0
+        rng = random.Random(zlib.crc32(f"{cfg.seed}|{station}|{epoch}".encode()))
+        return make_board(station.upper(), min(rows, cfg.trains), cfg.cancel_ratio, cfg.delay_ratio, rng)
+
+    return app
+
+def add_arguments(parser):
+    defaults = FakeConfig()
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="Mean response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter, help="Uniform +/- spread on the delay")
+    parser.add_argument("--trains", type=int, default=defaults.trains, help="Services per board")
+    parser.add_argument("--cancel-ratio", type=float, default=defaults.cancel_ratio)
+    parser.add_argument("--delay-ratio", type=float, default=defaults.delay_ratio)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="Fraction of requests answered 503")
+    parser.add_argument("--refresh", type=float, default=defaults.refresh, help="Seconds before a station's board changes")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+def config_from_args(args):
+    return FakeConfig(args.latency, args.jitter, args.trains, args.cancel_ratio, args.delay_ratio,
+                      args.error_rate, args.refresh, args.seed)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local Huxley stand-in (point HUXLEY_BASE_URL at it)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,170 @@
+import argparse
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import httpx
+from sqlalchemy.engine import make_url
+from benchmarks import fake_huxley
+from benchmarks.report import build_report, summarise, write_report
+
+SCENARIOS = ("health", "departures", "incident_create", "login")
+READY_TIMEOUT = 30
+
+def start_process(args, env=None):
+    return subprocess.Popen([sys.executable, *args], env={**os.environ, **(env or {})})
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def wait_ready(url, process):
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before becoming ready")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {READY_TIMEOUT}s")
+
+async def drive(send, duration, concurrency):
+    # `concurrency` closed-loop workers for `duration` seconds; a request fails on an exception or status >= 400
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await send(next(counter))
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarise(latencies, errors, time.perf_counter() - started)
+
+async def run_scenarios(base_url, scenarios, stations, duration, concurrency, warmup):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        email, password = f"bench_{uuid.uuid4().hex[:8]}@railpulse.com", "benchmark-password"
+        await client.post("/users/register", json={"email": email, "password": password})
+        login = await client.post("/users/login", data={"username": email, "password": password})
+        login.raise_for_status()
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        requests = {
+            "health": lambda i: client.get(f"/analytics/{stations[i % len(stations)]}/health"),
+            "departures": lambda i: client.get(f"/live/departures/{stations[i % len(stations)]}"),
+            "incident_create": lambda i: client.post("/incidents/", headers=headers, json={
+                "station_code": stations[i % len(stations)],
+                "type": "Crowding",
+                "severity": 1 + i % 5,
+                "description": "Load test report",
+            }),
+            "login": lambda i: client.post("/users/login", data={"username": email, "password": password}),
+        }
+
+        results = {}
+        for name in scenarios:
+            if warmup:
+                await drive(requests[name], warmup, concurrency)
+            results[name] = await drive(requests[name], duration, concurrency)
+            print(f"  {name:16} {results[name]}", file=sys.stderr)
+        return results
+
+def backend_name(url, taken):
+    # "sqlite", "postgresql", then "postgresql_2"... when a backend is listed twice
+    base = name = make_url(url).get_backend_name()
+    suffix = 2
+    while name in taken:
+        name, suffix = f"{base}_{suffix}", suffix + 1
+    return name
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test against a local Huxley stand-in")
+    parser.add_argument("--database-url", action="append", dest="database_urls",
+                        help="Repeat to compare backends, e.g. a local PostgreSQL (default: temporary SQLite)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--stations", default="LDS,MAN,YRK,KGX")
+    parser.add_argument("--duration", type=float, default=10, help="Measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2, help="Unmeasured seconds before each scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--app-port", type=int, default=8098)
+    parser.add_argument("--huxley-port", type=int, default=8099)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra settings for the app under test, e.g. BOARD_CACHE_TTL=0")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    fake_huxley.add_arguments(parser)
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    stations = [s.strip().upper() for s in args.stations.split(",") if s.strip()]
+    database_urls = args.database_urls or [f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"]
+    extra_env = dict(item.split("=", 1) for item in args.env)
+
+    huxley_args = ["--port", str(args.huxley_port), "--latency", str(args.latency), "--jitter", str(args.jitter),
+                   "--trains", str(args.trains), "--cancel-ratio", str(args.cancel_ratio),
+                   "--delay-ratio", str(args.delay_ratio), "--error-rate", str(args.error_rate),
+                   "--refresh", str(args.refresh), "--seed", str(args.seed)]
+    huxley = start_process(["-m", "benchmarks.fake_huxley", *huxley_args])
+    results = {}
+    try:
+        wait_ready(f"http://127.0.0.1:{args.huxley_port}/docs", huxley)
+        for url in database_urls:
+            name = backend_name(url, results)
+            print(f"{name}:", file=sys.stderr)
+            app = start_process(
+                ["-m", "uvicorn", "src.main:app", "--port", str(args.app_port), "--log-level", "warning"],
+                env={
+                    "DATABASE_URL": url,
+                    "HUXLEY_BASE_URL": f"http://127.0.0.1:{args.huxley_port}",
+                    "OLDBWS_TOKEN": "benchmark",
+                    "SECRET_KEY": os.environ.get("SECRET_KEY", "benchmark-secret"),
+                    **extra_env,
+                },
+            )
+            try:
+                base_url = f"http://127.0.0.1:{args.app_port}"
+                wait_ready(base_url + "/", app)
+                results[name] = asyncio.run(run_scenarios(
+                    base_url, scenarios, stations, args.duration, args.concurrency, args.warmup
+                ))
+            finally:
+                stop_process(app)
+    finally:
+        stop_process(huxley)
+
+    config = {
+        "scenarios": scenarios,
+        "stations": stations,
+        "duration": args.duration,
+        "concurrency": args.concurrency,
+        "app_env": extra_env,
+        "huxley": vars(fake_huxley.config_from_args(args)),
+    }
+    write_report(build_report("load", config, results), args.output)
+
+if __name__ == "__main__":
+    main()
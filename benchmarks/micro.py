@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import os
+import random
+import time
+import timeit
+
+# The analytics router builds its engines at import; benchmarks never touch the database
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from src import rail_service, fast_json, scoring, hub_health  # noqa: E402
+from src.incident_window import IncidentWindow  # noqa: E402
+from src.routers import analytics  # noqa: E402
+from benchmarks.fake_huxley import make_board  # noqa: E402
+from benchmarks.report import build_report, write_report  # noqa: E402
+
+def measure(fn, min_time=0.2, repeat=5):
+    # Best of `repeat` runs, each sized to last about `min_time`, reported per call
+    number, elapsed = 1, 0.0
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timeit.timeit(fn, number=number)
+    best = min(timeit.repeat(fn, number=number, repeat=repeat))
+    return {"per_call_us": round(best / number * 1e6, 3), "calls": number}
+
+def run(sizes=(10, 50, 200), cancel_ratio=0.05, delay_ratio=0.2, min_time=0.2):
+    results = {}
+    for size in sizes:
+        raw = make_board("LDS", size, cancel_ratio, delay_ratio, random.Random(size))
+        board = rail_service.parse_board(raw, "LDS")
+        payload = hub_health.compute_hub_health("LDS", board, 3, 2.5)
+        results[f"trains_{size}"] = {
+            "parse_board": measure(lambda: rail_service.parse_board(raw, "LDS"), min_time),
+            "board_from_trains": measure(lambda: rail_service.Board.from_trains(board.station_name, board.trains), min_time),
+            "compute_hub_health": measure(lambda: hub_health.compute_hub_health("LDS", board, 3, 2.5), min_time),
+            "departures_dicts": measure(board.departures, min_time),
+            "render_departures": measure(lambda: analytics.render_departures(board), min_time),
+            "render_health": measure(lambda: fast_json.dumps(payload), min_time),
+        }
+
+    # Hot read paths that sit in front of every health request
+    cache = rail_service.BoardCache(ttl=3600, stale_ttl=0)
+    cache.put("LDS", rail_service.EMPTY_BOARD)
+    window = IncidentWindow()
+    now = time.time()
+    window.seed([(i, "LDS", None, 1 + i % 5) for i in range(500)], ["LDS"])
+    # Hits are awaited in batches on one loop, so asyncio.run's setup isn't what gets timed
+    async def hits(n=1000):
+        for _ in range(n):
+            await cache.get_async("LDS", None)
+    hit = measure(lambda: asyncio.run(hits()), min_time)
+    results["board_cache_hit"] = {"per_call_us": round(hit["per_call_us"] / 1000, 3), "calls": hit["calls"] * 1000}
+    results["incident_window_stats"] = measure(lambda: window.stats("LDS", now), min_time)
+
+    # Rescoring a month of minute-level snapshots for one hub
+    rng = random.Random(0)
+    rows = 31 * 24 * 60
+    columns = ([rng.uniform(0, 5) for _ in range(rows)], [rng.uniform(0, 60) for _ in range(rows)],
+               [rng.randint(0, 10) for _ in range(rows)], [50] * rows)
+    results["score_batch_month"] = {**measure(lambda: scoring.score_batch(*columns), min_time, repeat=3), "rows": rows}
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for board parsing, scoring and rendering")
+    parser.add_argument("--sizes", default="10,50,200", help="Comma-separated trains per board")
+    parser.add_argument("--cancel-ratio", type=float, default=0.05)
+    parser.add_argument("--delay-ratio", type=float, default=0.2)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds per timing run")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    sizes = tuple(int(s) for s in args.sizes.split(","))
+    config = {"sizes": sizes, "cancel_ratio": args.cancel_ratio, "delay_ratio": args.delay_ratio,
+              "orjson": fast_json.orjson is not None, "numpy": scoring.np is not None}
+    results = run(sizes, args.cancel_ratio, args.delay_ratio, args.min_time)
+    write_report(build_report("micro", config, results), args.output)
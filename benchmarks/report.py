@@ -0,0 +1,107 @@
+import argparse
+import json
+import math
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+# Lower is better for these; throughput is compared the other way round
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms", "mean_ms", "per_call_us")
+COMPARED_KEYS = LATENCY_KEYS + ("throughput_rps",)
+
+def percentile(sorted_values, q):
+    # Nearest-rank on an already sorted list; None when there is nothing to rank
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(q / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def summarise(seconds, errors=0, elapsed=None):
+    # Latencies in seconds -> the figures every report carries, in milliseconds
+    values = sorted(seconds)
+    summary = {
+        "requests": len(values),
+        "errors": errors,
+        "p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None,
+    }
+    if values:
+        summary.update(
+            p50_ms=round(percentile(values, 50) * 1000, 3),
+            p95_ms=round(percentile(values, 95) * 1000, 3),
+            p99_ms=round(percentile(values, 99) * 1000, 3),
+            mean_ms=round(sum(values) / len(values) * 1000, 3),
+            max_ms=round(values[-1] * 1000, 3),
+        )
+    if elapsed:
+        summary["throughput_rps"] = round(len(values) / elapsed, 1)
+    return summary
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def build_report(kind, config, results):
+    return {
+        "kind": kind,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+
+def write_report(report, path=None):
+    text = json.dumps(report, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+def _flatten(results, prefix=""):
+    # {"sqlite": {"health": {...}}} -> {"sqlite/health": {...}}
+    flat = {}
+    for name, value in results.items():
+        if isinstance(value, dict) and any(key in value for key in COMPARED_KEYS):
+            flat[prefix + name] = value
+        elif isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{name}/"))
+    return flat
+
+def compare(baseline, candidate, threshold=0.1):
+    # (rows, regressions): a latency up, or throughput down, by more than `threshold` is a regression
+    base, cand = _flatten(baseline["results"]), _flatten(candidate["results"])
+    rows, regressions = [], []
+    for name in sorted(base.keys() & cand.keys()):
+        for key in COMPARED_KEYS:
+            old, new = base[name].get(key), cand[name].get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change < -threshold if key == "throughput_rps" else change > threshold
+            rows.append((name, key, old, new, change))
+            if worse:
+                regressions.append((name, key, old, new, change))
+    return rows, regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed relative slowdown (0.1 = 10%%)")
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows, regressions = compare(baseline, candidate, args.threshold)
+    for name, key, old, new, change in rows:
+        flag = "  REGRESSION" if (name, key, old, new, change) in regressions else ""
+        print(f"{name:40} {key:15} {old:>12} -> {new:>12} ({change:+.1%}){flag}")
+    sys.exit(1 if regressions else 0)
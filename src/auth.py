@@ -1,13 +1,19 @@
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import NamedTuple, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from . import database, models
+from . import database, models, metrics
 from dotenv import load_dotenv
 import os   
+import asyncio
+import threading
+import time
+import uuid
 
 load_dotenv()
 
@@ -16,15 +22,127 @@ SECRET_KEY = os.environ.get("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Principal Cache Configuration
+AUTH_CACHE_TTL = float(os.environ.get("AUTH_CACHE_TTL", 60))
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", 10000))
+# Trust uid/active claims in the token and skip the user lookup entirely
+AUTH_TRUST_TOKEN_CLAIMS = os.environ.get("AUTH_TRUST_TOKEN_CLAIMS", "false").lower() in ("1", "true", "yes")
+
+# Password Pool Configuration (bcrypt releases the GIL, so threads give real parallelism)
+PASSWORD_POOL_WORKERS = int(os.environ.get("PASSWORD_POOL_WORKERS", 4))
+PASSWORD_QUEUE_LIMIT = int(os.environ.get("PASSWORD_QUEUE_LIMIT", 32))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/login")
 
+# The authenticated caller, detached from any DB session
+class Principal(NamedTuple):
+    id: uuid.UUID
+    email: str
+    is_active: bool
+
+# Bounded TTL cache of verified principals keyed by token subject
+class PrincipalCache:
+    def __init__(self, ttl=AUTH_CACHE_TTL, max_entries=AUTH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, subject):
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None:
+                return None
+            principal, stored_at = entry
+            if time.monotonic() - stored_at >= self.ttl:
+                del self._entries[subject]
+                return None
+            self._entries.move_to_end(subject)
+            return principal
+
+    def put(self, subject, principal):
+        with self._lock:
+            self._entries[subject] = (principal, time.monotonic())
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, subject):
+        with self._lock:
+            self._entries.pop(subject, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+principal_cache = PrincipalCache()
+
+# Call whenever a user is deactivated, deleted, re-registered or changes email
+def invalidate_user(email):
+    principal_cache.invalidate(email)
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# Dedicated, size-limited pool for bcrypt so a login burst can't starve other routes
+class PasswordPool:
+    def __init__(self, workers=PASSWORD_POOL_WORKERS, queue_limit=PASSWORD_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._stats = {"completed": 0, "rejected": 0, "wait_seconds": 0.0, "hash_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    async def run(self, fn, *args):
+        with self._lock:
+            # Shed load instead of queueing requests that would time out anyway
+            if self._pending >= self.workers + self.queue_limit:
+                self._stats["rejected"] += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Authentication is busy, please retry",
+                    headers={"Retry-After": "1"},
+                )
+            self._pending += 1
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                finished = time.perf_counter()
+                metrics.BCRYPT_WAIT_SECONDS.observe(started - submitted, fn.__name__)
+                metrics.BCRYPT_SECONDS.observe(finished - started, fn.__name__)
+                with self._lock:
+                    self._stats["completed"] += 1
+                    self._stats["wait_seconds"] += started - submitted
+                    self._stats["hash_seconds"] += finished - started
+                    self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], started - submitted)
+
+        try:
+            return await asyncio.wrap_future(self._executor.submit(timed))
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "pending": self._pending}
+
+password_pool = PasswordPool()
+
+async def verify_password_async(plain_password, hashed_password):
+    return await password_pool.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await password_pool.run(get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -35,6 +153,10 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def token_claims(user: models.User):
+    # uid/active let the hot path skip the database when AUTH_TRUST_TOKEN_CLAIMS is on
+    return {"sub": user.email, "uid": str(user.id), "active": bool(user.is_active)}
+
 # DEPENDENCY: Protects endpoints
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
     credentials_exception = HTTPException(
@@ -49,8 +171,26 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-        
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if user is None:
+
+    if AUTH_TRUST_TOKEN_CLAIMS and payload.get("uid"):
+        try:
+            principal = Principal(uuid.UUID(payload["uid"]), email, bool(payload.get("active", True)))
+        except ValueError:
+            raise credentials_exception
+        metrics.AUTH_LOOKUPS.inc("claims")
+    else:
+        principal = principal_cache.get(email)
+        if principal is None:
+            with metrics.DB_QUERY_SECONDS.time("current_user"):
+                user = db.query(models.User).filter(models.User.email == email).first()
+            if user is None:
+                raise credentials_exception
+            principal = Principal(user.id, user.email, bool(user.is_active))
+            principal_cache.put(email, principal)
+            metrics.AUTH_LOOKUPS.inc("db")
+        else:
+            metrics.AUTH_LOOKUPS.inc("cache")
+
+    if not principal.is_active:
         raise credentials_exception
-    return user
\ No newline at end of file
+    return principal
\ No newline at end of file
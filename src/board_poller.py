@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from . import rail_service
+
+logger = logging.getLogger(__name__)
+
+# Poller Configuration
+POLL_STATIONS = [c.strip().upper() for c in os.environ.get("BOARD_POLL_STATIONS", "").split(",") if c.strip()]
+POLL_INTERVAL = float(os.environ.get("BOARD_POLL_INTERVAL", 20))
+POLL_JITTER = float(os.environ.get("BOARD_POLL_JITTER", 0.1))
+POLL_MAX_BACKOFF = float(os.environ.get("BOARD_POLL_MAX_BACKOFF", 300))
+
+# Keeps the board cache warm for hub stations so requests never wait on Huxley
+class BoardPoller:
+    def __init__(self, stations=POLL_STATIONS, interval=POLL_INTERVAL, jitter=POLL_JITTER,
+                 max_backoff=POLL_MAX_BACKOFF, cache=None):
+        self.stations = [s.upper() for s in stations]
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.cache = cache or rail_service.board_cache
+        self._tasks = []
+        self._state = {s: {"failures": 0, "last_success": None, "last_error": None} for s in self.stations}
+
+    async def start(self):
+        for station in self.stations:
+            self._tasks.append(asyncio.create_task(self._run(station)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def status(self):
+        return {s: dict(state) for s, state in self._state.items()}
+
+    async def _run(self, station):
+        state = self._state[station]
+        # Stagger the first round so hubs don't all hit Huxley in the same instant
+        await asyncio.sleep(random.uniform(0, self.interval * self.jitter))
+        while True:
+            try:
+                board = await rail_service.load_board_async(station)
+                self.cache.put(station, board)
+                state["failures"] = 0
+                state["last_success"] = time.time()
+                delay = self.interval
+            except Exception as e:
+                state["failures"] += 1
+                state["last_error"] = repr(e)
+                delay = min(self.interval * (2 ** state["failures"]), self.max_backoff)
+                logger.warning("Board poll for %s failed (%d in a row): %r", station, state["failures"], e)
+            await asyncio.sleep(delay * random.uniform(1 - self.jitter, 1 + self.jitter))
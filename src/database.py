@@ -1,21 +1,180 @@
+import logging
 import os
+import threading
+import time
+from contextlib import asynccontextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Optional read replica for analytics and listing reads
+REPLICA_DATABASE_URL = os.getenv("DATABASE_REPLICA_URL")
+REPLICA_MAX_STALENESS = float(os.getenv("REPLICA_MAX_STALENESS", 5))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", 2))
+
+# Pool Configuration (ignored for SQLite, which manages its own connections)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+
+# Time spent waiting for a pooled connection, per engine
+class _PoolWaits:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {"waits": self.count, "wait_seconds": self.total_seconds, "max_wait_seconds": self.max_seconds}
+
+class TimedQueuePool(QueuePool):
+    waits = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.waits is not None:
+                self.waits.record(time.perf_counter() - started)
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool, TimedQueuePool):
+    pass
+
+def async_url(url, override_env="ASYNC_DATABASE_URL"):
+    # postgresql:// -> postgresql+asyncpg:// (sslmode becomes asyncpg's ssl), sqlite -> aiosqlite
+    url = make_url((override_env and os.getenv(override_env)) or url)
+    if url.drivername in ("postgresql", "postgresql+psycopg2", "postgres"):
+        query = dict(url.query)
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        return url.set(drivername="postgresql+asyncpg", query=query)
+    if url.drivername in ("sqlite", "sqlite+pysqlite"):
+        return url.set(drivername="sqlite+aiosqlite")
+    return url
+
+def engine_options(url, is_async=False):
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        return {}
+    options = {
+        "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if DB_STATEMENT_TIMEOUT_MS and url.get_backend_name() == "postgresql":
+        if is_async:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"}
+    return options
+
+def _attach_waits(engine):
+    pool = engine.pool if hasattr(engine, "pool") else engine.sync_engine.pool
+    if isinstance(pool, TimedQueuePool):
+        pool.waits = _PoolWaits()
+    return engine
+
 # Create the Connection Engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, pool_pre_ping=True
-)
+engine = _attach_waits(create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL)))
+
+# Async engine for the incidents and analytics routers
+async_engine = _attach_waits(create_async_engine(
+    async_url(SQLALCHEMY_DATABASE_URL), **engine_options(SQLALCHEMY_DATABASE_URL, is_async=True)
+))
 
 # Session Factory creates new DB connections for each request
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Replay lag in seconds; zero when the replica has applied everything it received
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+# Sends reads to the replica while its lag stays under max_staleness, otherwise to the primary
+class ReplicaRouter:
+    def __init__(self, replica_engine=None, max_staleness=REPLICA_MAX_STALENESS, check_interval=REPLICA_LAG_CHECK_INTERVAL):
+        self.engine = replica_engine
+        self.session_factory = (
+            async_sessionmaker(replica_engine, autoflush=False, expire_on_commit=False) if replica_engine else None
+        )
+        self.max_staleness = max_staleness
+        self.check_interval = check_interval
+        self.lag = None
+        self.checked_at = 0.0
+        self._checking = False
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    async def measure_lag(self):
+        if self.engine.dialect.name != "postgresql":
+            return 0.0
+        async with self.engine.connect() as conn:
+            return float((await conn.execute(REPLICA_LAG_SQL)).scalar())
+
+    async def use_replica(self):
+        if self.engine is None:
+            return False
+        # One probe at a time; concurrent readers go with the last measurement
+        if not self._checking and time.monotonic() - self.checked_at >= self.check_interval:
+            self._checking = True
+            try:
+                self.lag = await self.measure_lag()
+            except Exception as e:
+                logger.warning("Replica lag check failed, reading from primary: %r", e)
+                self.lag = None
+            finally:
+                self.checked_at = time.monotonic()
+                self._checking = False
+        healthy = self.lag is not None and self.lag <= self.max_staleness
+        if healthy:
+            self.replica_reads += 1
+        else:
+            self.primary_reads += 1
+        return healthy
+
+    def stats(self):
+        return {
+            "configured": self.engine is not None,
+            "lag_seconds": self.lag,
+            "max_staleness": self.max_staleness,
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+        }
+
+replica_engine = None
+if REPLICA_DATABASE_URL:
+    replica_engine = _attach_waits(create_async_engine(
+        async_url(REPLICA_DATABASE_URL, override_env=None), **engine_options(REPLICA_DATABASE_URL, is_async=True)
+    ))
+replica = ReplicaRouter(replica_engine)
 
 # Base class
 Base = declarative_base()
@@ -27,4 +186,35 @@ def get_db():
         yield db
     finally:
         db.close()
-        
\ No newline at end of file
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Reads that tolerate REPLICA_MAX_STALENESS seconds of lag; writes stay on get_db / get_async_db
+@asynccontextmanager
+async def read_session():
+    factory = replica.session_factory if await replica.use_replica() else AsyncSessionLocal
+    async with factory() as db:
+        yield db
+
+async def get_read_db():
+    async with read_session() as db:
+        yield db
+
+def pool_stats():
+    # Checked-out / overflow / idle connections and checkout wait, for monitoring
+    stats = {}
+    pools = [("sync", engine.pool), ("async", async_engine.sync_engine.pool)]
+    if replica_engine is not None:
+        pools.append(("replica", replica_engine.sync_engine.pool))
+    for name, pool in pools:
+        entry = {"status": pool.status()}
+        if isinstance(pool, QueuePool):
+            entry.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow(),
+                         idle=pool.checkedin())
+        if getattr(pool, "waits", None) is not None:
+            entry.update(pool.waits.snapshot())
+        stats[name] = entry
+    stats["replica_routing"] = replica.stats()
+    return stats
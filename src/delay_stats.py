@@ -0,0 +1,189 @@
+import bisect
+import math
+import os
+import threading
+import time
+
+# Delay Distribution Configuration
+DELAY_RELATIVE_ACCURACY = float(os.environ.get("DELAY_RELATIVE_ACCURACY", 0.01))
+DELAY_BUCKET_SECONDS = int(os.environ.get("DELAY_BUCKET_SECONDS", 300))
+DELAY_RETENTION_SECONDS = int(os.environ.get("DELAY_RETENTION_SECONDS", 86400))
+# Upper-exclusive histogram edges in minutes: 0, 1-4, 5-14, 15-29, 30-59, 60-119, 120+
+DELAY_HISTOGRAM_BINS = tuple(int(b) for b in os.environ.get("DELAY_HISTOGRAM_BINS", "1,5,15,30,60,120").split(","))
+QUANTILES = (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))
+
+_GAMMA = (1 + DELAY_RELATIVE_ACCURACY) / (1 - DELAY_RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+def histogram_labels(bins=DELAY_HISTOGRAM_BINS):
+    labels = []
+    for i in range(len(bins) + 1):
+        lower = bins[i - 1] if i else 0
+        if i == len(bins):
+            labels.append(f"{lower}+")
+        else:
+            upper = bins[i] - 1
+            labels.append(str(lower) if upper <= lower else f"{lower}-{upper}")
+    return labels
+
+HISTOGRAM_LABELS = histogram_labels()
+
+# Mergeable quantile sketch over delay minutes (DDSketch-style logarithmic buckets): every
+# quantile is within DELAY_RELATIVE_ACCURACY of the true value, merging two sketches adds their
+# counts, and a value can be taken back out when a train's delay is revised
+class DelaySketch:
+    __slots__ = ("buckets", "zeros", "count", "histogram")
+
+    def __init__(self):
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.histogram = [0] * len(HISTOGRAM_LABELS)
+
+    def add(self, minutes, n=1):
+        if minutes <= 0:
+            self.zeros += n
+        else:
+            key = math.ceil(math.log(minutes) / _LOG_GAMMA)
+            count = self.buckets.get(key, 0) + n
+            if count:
+                self.buckets[key] = count
+            else:
+                del self.buckets[key]
+        self.histogram[bisect.bisect_right(DELAY_HISTOGRAM_BINS, minutes)] += n
+        self.count += n
+
+    def remove(self, minutes):
+        self.add(minutes, -1)
+
+    def merge(self, other):
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+        return self
+
+    def quantile(self, q):
+        if self.count <= 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                # Midpoint of the bucket (gamma^(k-1), gamma^k] in relative terms
+                return 2 * _GAMMA ** key / (_GAMMA + 1)
+        return 2 * _GAMMA ** max(self.buckets) / (_GAMMA + 1)
+
+class _Series:
+    # Delays of running trains plus a separate cancellation count (cancellations have no delay)
+    __slots__ = ("sketch", "cancelled")
+
+    def __init__(self):
+        self.sketch = DelaySketch()
+        self.cancelled = 0
+
+    def observe(self, minutes, n=1):
+        if minutes is None:
+            self.cancelled += n
+        else:
+            self.sketch.add(minutes, n)
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        self.cancelled += other.cancelled
+        return self
+
+    def summary(self):
+        sketch = self.sketch
+        summary = {"samples": sketch.count, "cancelled": self.cancelled}
+        for name, q in QUANTILES:
+            value = sketch.quantile(q)
+            summary[f"{name}_minutes"] = round(value, 1) if value is not None else None
+        summary["histogram"] = dict(zip(HISTOGRAM_LABELS, sketch.histogram))
+        return summary
+
+class _TimeBucket:
+    # One station over DELAY_BUCKET_SECONDS: each service counts once, with its latest delay
+    __slots__ = ("total", "operators", "services")
+
+    def __init__(self):
+        self.total = _Series()
+        self.operators = {}
+        self.services = {}   # service key -> (minutes or None if cancelled, operator)
+
+    def record(self, key, minutes, operator):
+        observation = (minutes, operator)
+        previous = self.services.get(key)
+        if previous == observation:
+            return
+        if previous is not None:
+            self._observe(*previous, n=-1)
+        self.services[key] = observation
+        self._observe(minutes, operator, n=1)
+
+    def _observe(self, minutes, operator, n):
+        self.total.observe(minutes, n)
+        series = self.operators.get(operator)
+        if series is None:
+            series = self.operators[operator] = _Series()
+        series.observe(minutes, n)
+
+# Per-station, per-operator delay distributions in time buckets, updated from every board
+# refresh. Recording the same board twice is a no-op, so workers sharing boards never double count.
+class DelayStats:
+    def __init__(self, bucket_seconds=DELAY_BUCKET_SECONDS, retention_seconds=DELAY_RETENTION_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._stations = {}  # station code -> {bucket start: _TimeBucket}
+
+    def record_board(self, station_code, board, now=None):
+        now = now or time.time()
+        start = int(now // self.bucket_seconds) * self.bucket_seconds
+        with self._lock:
+            buckets = self._stations.setdefault(station_code, {})
+            bucket = buckets.get(start)
+            if bucket is None:
+                bucket = buckets[start] = _TimeBucket()
+                self._expire(buckets, now)
+            for train in board.trains:
+                key = train.train_id or (train.from_code, train.scheduled)
+                minutes = None if train.status == "Cancelled" else train.delay_weight
+                bucket.record(key, minutes, train.operator or "Unknown")
+
+    def summary(self, station_codes=None, window_seconds=3600, now=None):
+        # Per-station summaries and a network-wide one, all merged from bucket sketches
+        now = now or time.time()
+        oldest = now - window_seconds - self.bucket_seconds
+        network = _Series()
+        stations = {}
+        with self._lock:
+            codes = station_codes if station_codes is not None else sorted(self._stations)
+            for code in codes:
+                total, operators = _Series(), {}
+                for start, bucket in self._stations.get(code, {}).items():
+                    if start <= oldest:
+                        continue
+                    total.merge(bucket.total)
+                    for operator, series in bucket.operators.items():
+                        operators.setdefault(operator, _Series()).merge(series)
+                network.merge(total)
+                stations[code] = {
+                    **total.summary(),
+                    "operators": {op: s.summary() for op, s in sorted(operators.items()) if s.sketch.count or s.cancelled},
+                }
+        return {"window_seconds": window_seconds, "network": network.summary(), "stations": stations}
+
+    def reset(self):
+        with self._lock:
+            self._stations.clear()
+
+    def _expire(self, buckets, now):
+        for start in [s for s in buckets if s < now - self.retention_seconds]:
+            del buckets[start]
+
+stats = DelayStats()
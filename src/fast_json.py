@@ -0,0 +1,63 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+# Optional dependency: orjson is used when installed, stdlib json otherwise
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Opt-in: serve pre-rendered bytes for board-backed responses
+FAST_JSON = os.environ.get("FAST_JSON", "false").lower() in ("1", "true", "yes")
+RENDER_MEMO_SIZE = int(os.environ.get("FAST_JSON_MEMO_SIZE", 1024))
+
+def dumps(content):
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(jsonable_encoder(content), separators=(",", ":")).encode()
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def extend(body, fields):
+    # Adds top-level fields to an already rendered, non-empty JSON object without re-rendering it
+    return body[:-1] + b"," + dumps(fields)[1:]
+
+# Sends bytes as-is; anything else goes through dumps() without pydantic validation
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        return content if isinstance(content, bytes) else dumps(content)
+
+# Small thread-safe LRU for values derived from an immutable snapshot (keyed by ETag)
+class Memo:
+    def __init__(self, max_entries=RENDER_MEMO_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key, factory):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                return value
+        # Build outside the lock; a racing duplicate is harmless since inputs are immutable
+        value = factory()
+        with self._lock:
+            value = self._entries.setdefault(key, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from dataclasses import fields
+from datetime import datetime
+from sqlalchemy import insert, text
+from . import database, models, rail_service, scoring, shared_cache
+from .board_poller import POLL_STATIONS
+from .hub_health import compute_hub_health, get_crowd_stats, rescore_snapshots
+
+logger = logging.getLogger(__name__)
+
+# Sampler Configuration (defaults to the hubs the board poller keeps warm)
+SNAPSHOT_STATIONS = [
+    c.strip().upper() for c in os.environ.get("HEALTH_SNAPSHOT_STATIONS", ",".join(POLL_STATIONS)).split(",") if c.strip()
+]
+SNAPSHOT_INTERVAL = float(os.environ.get("HEALTH_SNAPSHOT_INTERVAL", 60))
+
+def _month_start(when, months_ahead=0):
+    month = when.year * 12 + when.month - 1 + months_ahead
+    return datetime(month // 12, month % 12 + 1, 1)
+
+async def ensure_partitions(db, when):
+    # PostgreSQL with the partitioned table from create_tables.sql: this month's and next month's
+    # partitions exist before any row needs them (anything else lands in the DEFAULT partition)
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    partitioned = (await db.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('hub_health_snapshots')"
+    ))).first()
+    if partitioned is None:
+        return
+    for ahead in (0, 1):
+        start, end = _month_start(when, ahead), _month_start(when, ahead + 1)
+        await db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS hub_health_snapshots_{start:%Y_%m} PARTITION OF hub_health_snapshots "
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        ))
+    await db.commit()
+
+# Periodically scores each configured hub and appends one row per station in a single INSERT.
+# Rounds are aligned to the interval; with a shared store, one worker across the fleet takes each round.
+class HealthSampler:
+    def __init__(self, stations=SNAPSHOT_STATIONS, interval=SNAPSHOT_INTERVAL, session_factory=None, store=None):
+        self.stations = list(stations)
+        self.interval = interval
+        self.session_factory = session_factory or database.AsyncSessionLocal
+        self.store = store if store is not None else shared_cache.cache.store
+        self._partitions_month = None
+        self._task = None
+
+    async def start(self):
+        if self.stations:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval - time.time() % self.interval)
+            try:
+                if await self.claim_round(int(time.time() // self.interval)):
+                    await self.sample_once()
+            except Exception as e:
+                logger.warning("Health snapshot round failed: %r", e)
+
+    async def claim_round(self, round_number):
+        # Without a shared store every worker samples; a store error also falls back to sampling
+        if self.store is None:
+            return True
+        key = f"{shared_cache.SHARED_CACHE_PREFIX}health_sampler:{round_number}"
+        try:
+            return await asyncio.to_thread(self.store.add, key, b"1", self.interval * 2)
+        except Exception as e:
+            logger.warning("Health sampler round lock failed, sampling anyway: %r", e)
+            return True
+
+    async def sample_once(self):
+        sampled_at = datetime.now()
+        async with self.session_factory() as db:
+            month = _month_start(sampled_at)
+            if month != self._partitions_month:
+                try:
+                    await ensure_partitions(db, sampled_at)
+                    self._partitions_month = month
+                except Exception as e:
+                    await db.rollback()
+                    logger.warning("Creating hub_health_snapshots partitions failed: %r", e)
+            boards = await asyncio.gather(
+                *(rail_service.get_board_async(c) for c in self.stations), return_exceptions=True
+            )
+            report_stats = await get_crowd_stats(db, self.stations)
+
+            rows = []
+            for code, board in zip(self.stations, boards):
+                if isinstance(board, Exception):
+                    continue
+                health = compute_hub_health(code, board, *report_stats[code])
+                rows.append({
+                    "station_code": code,
+                    "sampled_at": sampled_at,
+                    "stress_index": health["stress_index"],
+                    "hub_status": health["hub_status"],
+                    "total_trains": len(board.trains),
+                    **health["metrics"],
+                })
+            if rows:
+                await write_snapshots(db, rows)
+            return rows
+
+async def write_snapshots(db, rows):
+    await db.execute(insert(models.HubHealthSnapshot), rows)
+    await db.commit()
+
+async def _backfill(args):
+    cfg = scoring.with_overrides(**vars(args))
+    async with database.AsyncSessionLocal() as db:
+        summary = await rescore_snapshots(db, args.start, args.end, args.stations, cfg, write=args.write, max_rows=None)
+    await database.async_engine.dispose()
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rescore stored hub health snapshots (dry run unless --write)")
+    parser.add_argument("--from", dest="start", type=datetime.fromisoformat, required=True)
+    parser.add_argument("--to", dest="end", type=datetime.fromisoformat, default=datetime.now())
+    parser.add_argument("--stations", type=lambda v: [c.strip().upper() for c in v.split(",") if c.strip()])
+    parser.add_argument("--write", action="store_true", help="Update stress_index/hub_status on changed rows")
+    for field in fields(scoring.ScoringConfig):
+        parser.add_argument(f"--{field.name.replace('_', '-')}", dest=field.name, type=float)
+    print(asyncio.run(_backfill(parser.parse_args())))
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import re
+from . import database, rail_service
+from .hub_health import compute_hub_health, get_crowd_stats
+
+logger = logging.getLogger(__name__)
+
+# Stream Configuration
+STREAM_INTERVAL = float(os.environ.get("HEALTH_STREAM_INTERVAL", 5))
+STREAM_MAX_SUBSCRIBERS = int(os.environ.get("HEALTH_STREAM_MAX_SUBSCRIBERS", 500))
+# Distinct stations with a live feed; each one polls upstream on its own
+STREAM_MAX_FEEDS = int(os.environ.get("HEALTH_STREAM_MAX_FEEDS", 100))
+# Slow consumers keep only the newest payloads; older ones are dropped, never buffered
+STREAM_QUEUE_SIZE = 1
+
+CRS_CODE = re.compile(r"[A-Z]{3}")
+
+class StreamFull(Exception):
+    pass
+
+def normalise_station(station_code):
+    # One feed per station however the code is cased; anything but a 3-letter CRS code is refused
+    code = station_code.strip().upper()
+    if not CRS_CODE.fullmatch(code):
+        raise ValueError(f"Not a CRS station code: {station_code!r}")
+    return code
+
+def _fingerprint(payload):
+    # Everything except the timestamp: unchanged health is not re-sent
+    return (payload["stress_index"], payload["hub_status"], payload.get("degraded"),
+            tuple(sorted(payload["metrics"].items())))
+
+# One shared health computation per station, fanned out to every subscriber queue
+class StationFeed:
+    def __init__(self, station_code, compute, interval):
+        self.station_code = station_code
+        self.compute = compute
+        self.interval = interval
+        self.subscribers = set()
+        self.latest = None
+        self.dropped = 0
+        self._fingerprint = None
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, payload):
+        fingerprint = _fingerprint(payload)
+        if fingerprint == self._fingerprint:
+            return False
+        self._fingerprint = fingerprint
+        self.latest = payload
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(payload)
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                self.publish(await self.compute(self.station_code))
+            except Exception as e:
+                logger.warning("Health stream update for %s failed: %r", self.station_code, e)
+            await asyncio.sleep(self.interval)
+
+class HealthHub:
+    def __init__(self, interval=STREAM_INTERVAL, max_subscribers=STREAM_MAX_SUBSCRIBERS, max_feeds=STREAM_MAX_FEEDS,
+                 session_factory=None):
+        self.interval = interval
+        self.max_subscribers = max_subscribers
+        self.max_feeds = max_feeds
+        self.session_factory = session_factory or database.read_session
+        self.feeds = {}
+
+    def open(self, station_code):
+        feed = self.feeds.get(station_code)
+        if feed is None:
+            if len(self.feeds) >= self.max_feeds:
+                raise StreamFull(station_code)
+            feed = self.feeds[station_code] = StationFeed(station_code, self.compute, self.interval)
+            feed.start()
+        elif len(feed.subscribers) >= self.max_subscribers:
+            raise StreamFull(station_code)
+        queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        # New subscribers get the current state straight away
+        if feed.latest is not None:
+            queue.put_nowait(feed.latest)
+        feed.subscribers.add(queue)
+        return queue
+
+    def close(self, station_code, queue):
+        feed = self.feeds.get(station_code)
+        if feed is None:
+            return
+        feed.subscribers.discard(queue)
+        if not feed.subscribers:
+            feed.stop()
+            del self.feeds[station_code]
+
+    async def compute(self, station_code):
+        board = await rail_service.get_live_arrivals_async(hub_code=station_code)
+        async with self.session_factory() as db:
+            report_stats = await get_crowd_stats(db, [station_code])
+        return compute_hub_health(station_code, board, *report_stats[station_code])
+
+hub = HealthHub()
@@ -0,0 +1,144 @@
+import collections
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, rail_service, incident_window, metrics, scoring
+
+# Hub health scoring shared by the analytics routes, the live streams and the snapshot sampler
+
+# Rows a single what-if rescore may load into memory
+RESCORE_MAX_ROWS = int(os.environ.get("RESCORE_MAX_ROWS", 500000))
+
+async def get_station_report_stats(db: AsyncSession, station_code: str):
+    # Count and average in SQL; only two numbers come back, never the rows
+    one_hour_ago = datetime.now() - timedelta(hours=1)
+    with metrics.DB_QUERY_SECONDS.time("station_report_stats"):
+        report_count, avg_severity = (await db.execute(select(
+            func.count(models.Incident.id),
+            func.avg(models.Incident.severity)
+        ).where(
+            models.Incident.station_code == station_code,
+            models.Incident.created_at >= one_hour_ago
+        ))).one()
+    return report_count, float(avg_severity or 0)
+
+async def get_report_stats(db: AsyncSession, station_codes: List[str]):
+    # One grouped query for every station: {code: (report_count, avg_severity)}
+    one_hour_ago = datetime.now() - timedelta(hours=1)
+    with metrics.DB_QUERY_SECONDS.time("report_stats"):
+        rows = (await db.execute(select(
+            models.Incident.station_code,
+            func.count(models.Incident.id),
+            func.avg(models.Incident.severity)
+        ).where(
+            models.Incident.created_at >= one_hour_ago,
+            models.Incident.station_code.in_(station_codes)
+        ).group_by(models.Incident.station_code))).all()
+    # Stations without reports in the hour have no group at all
+    stats = dict.fromkeys(station_codes, (0, 0.0))
+    stats.update((code, (count, float(avg or 0))) for code, count, avg in rows)
+    return stats
+
+async def get_crowd_stats(db: AsyncSession, station_codes: List[str]):
+    # {code: (report_count, avg_severity)} from the rolling window, seeding unseen stations once
+    if incident_window.WINDOW_ENABLED:
+        window = incident_window.window
+        if not all(window.is_seeded(c) for c in station_codes):
+            with metrics.DB_QUERY_SECONDS.time("window_seed"):
+                await incident_window.ensure_seeded_async(db, station_codes)
+        stats = {c: window.stats(c) for c in station_codes}
+        if None not in stats.values():
+            return stats
+    if len(station_codes) == 1:
+        code = station_codes[0]
+        return {code: await get_station_report_stats(db, code)}
+    return await get_report_stats(db, station_codes)
+
+def compute_hub_health(station_code: str, board: rail_service.Board, report_count: int, avg_severity: float):
+    return {**compute_health_body(station_code, board, report_count, avg_severity), **freshness(board)}
+
+def compute_health_body(station_code: str, board: rail_service.Board, report_count: int, avg_severity: float):
+    # Rail Metrics come pre-aggregated on the board; no per-train work here
+    score, status = scoring.score_station(avg_severity, board.avg_delay, board.cancelled, len(board.trains))
+    return health_body(station_code, board, report_count, avg_severity, score, status)
+
+def health_payload(station_code: str, board: rail_service.Board, report_count: int, avg_severity: float,
+                   score: float, status: str):
+    return {**health_body(station_code, board, report_count, avg_severity, score, status), **freshness(board)}
+
+def health_body(station_code: str, board: rail_service.Board, report_count: int, avg_severity: float,
+                score: float, status: str):
+    # Everything derived from the board and crowd metrics, so it can be memoised per ETag
+    return {
+        "station": board.station_name, 
+        "station_code": station_code,
+        # With no live data at all, an empty board would otherwise score as GREEN
+        "hub_status": "UNKNOWN" if board is rail_service.EMPTY_BOARD else status,
+        "stress_index": round(score, 2),
+        "degraded": board.degraded,
+        "metrics": {
+            "cancellations": board.cancelled,
+            "avg_delay": round(board.avg_delay, 1),
+            "passenger_reports": report_count,
+            "avg_report_severity": round(avg_severity, 1)
+        }
+    }
+
+def freshness(board: rail_service.Board):
+    # Stamped on every response, never memoised: both move on with the clock
+    age = board.data_age
+    return {"timestamp": datetime.now(), "data_age_seconds": round(age, 1) if age is not None else None}
+
+async def load_snapshot_metrics(db: AsyncSession, start: datetime, end: datetime,
+                                station_codes: Optional[List[str]] = None, max_rows: Optional[int] = None):
+    # Columns in, columns out: (ids, severity, delay, cancellations, total_trains, scores, statuses)
+    snapshot = models.HubHealthSnapshot
+    stmt = select(
+        snapshot.id,
+        snapshot.avg_report_severity,
+        snapshot.avg_delay,
+        snapshot.cancellations,
+        snapshot.total_trains,
+        snapshot.stress_index,
+        snapshot.hub_status
+    ).where(snapshot.sampled_at >= start, snapshot.sampled_at < end)
+    if station_codes:
+        stmt = stmt.where(snapshot.station_code.in_(station_codes))
+    if max_rows:
+        stmt = stmt.limit(max_rows + 1)
+    rows = (await db.execute(stmt)).all()
+    if max_rows and len(rows) > max_rows:
+        raise ValueError(f"More than {max_rows} snapshots in range; narrow it")
+    return list(zip(*rows)) or [()] * 7
+
+async def rescore_snapshots(db: AsyncSession, start: datetime, end: datetime, station_codes: Optional[List[str]] = None,
+                            cfg: Optional[scoring.ScoringConfig] = None, write: bool = False,
+                            max_rows: Optional[int] = RESCORE_MAX_ROWS):
+    # Re-run the stress index over stored samples in one vectorised pass; optionally write changes back
+    ids, severity, delay, cancellations, total_trains, old_scores, old_statuses = await load_snapshot_metrics(
+        db, start, end, station_codes, max_rows
+    )
+    new_scores, new_statuses = scoring.score_batch(
+        [s or 0 for s in severity], [d or 0 for d in delay], [c or 0 for c in cancellations], total_trains, cfg
+    ).tolist()
+    changed = [
+        {"id": row_id, "stress_index": round(score, 2), "hub_status": status}
+        for row_id, score, status, old_score, old_status in zip(ids, new_scores, new_statuses, old_scores, old_statuses)
+        if round(score, 2) != old_score or status != old_status
+    ]
+    if write and changed:
+        await db.execute(update(models.HubHealthSnapshot), changed)
+        await db.commit()
+
+    count = len(ids)
+    return {
+        "rows": count,
+        "changed": len(changed),
+        "written": bool(write and changed),
+        "mean_stress_index": round(sum(new_scores) / count, 3) if count else None,
+        "previous_mean_stress_index": round(sum(s or 0 for s in old_scores) / count, 3) if count else None,
+        "status_counts": dict(collections.Counter(new_statuses)),
+        "previous_status_counts": dict(collections.Counter(old_statuses)),
+    }
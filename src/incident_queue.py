@@ -0,0 +1,217 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DataError, IntegrityError
+from . import database, metrics, models
+
+logger = logging.getLogger(__name__)
+
+# Write-Behind Configuration: off by default, every report is committed before it is acknowledged
+WRITE_BEHIND = os.environ.get("INCIDENT_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+QUEUE_MAX = int(os.environ.get("INCIDENT_QUEUE_MAX", 10000))
+FLUSH_SIZE = int(os.environ.get("INCIDENT_FLUSH_SIZE", 500))
+FLUSH_INTERVAL = float(os.environ.get("INCIDENT_FLUSH_INTERVAL", 0.5))
+# Append-only file for batches the database rejects; replayed once it is back. Empty = retry from memory
+SPILL_PATH = os.environ.get("INCIDENT_SPILL_PATH", "")
+SPILL_FSYNC = os.environ.get("INCIDENT_SPILL_FSYNC", "true").lower() in ("1", "true", "yes")
+# Reports the database refuses outright (unknown owner, oversized field); empty = log them only
+DEAD_LETTER_PATH = os.environ.get("INCIDENT_DEAD_LETTER_PATH", "")
+
+# The rows themselves are wrong: retrying will never succeed, unlike a lost connection or a timeout
+PERMANENT_ERRORS = (IntegrityError, DataError)
+
+def _insert(dialect):
+    # Inserts that skip ids already present, so a batch retried after an unacknowledged commit
+    # (or a spill file replayed twice) never conflicts on the primary key
+    if dialect == "postgresql":
+        return postgresql.insert(models.Incident).on_conflict_do_nothing(index_elements=["id"])
+    if dialect == "sqlite":
+        return sqlite.insert(models.Incident).on_conflict_do_nothing(index_elements=["id"])
+    return insert(models.Incident)
+
+def _encode_row(row):
+    return json.dumps({
+        **row,
+        "id": str(row["id"]),
+        "owner_id": str(row["owner_id"]),
+        "created_at": row["created_at"].isoformat(),
+    })
+
+def _decode_row(line):
+    row = json.loads(line)
+    row["id"] = uuid.UUID(row["id"])
+    row["owner_id"] = uuid.UUID(row["owner_id"])
+    row["created_at"] = datetime.fromisoformat(row["created_at"])
+    return row
+
+# Bounded in-process queue of accepted reports, group-committed by one background task
+# when FLUSH_SIZE rows are waiting or FLUSH_INTERVAL seconds have passed
+class IncidentWriter:
+    def __init__(self, session_factory=None, max_queue=QUEUE_MAX, flush_size=FLUSH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, spill_path=SPILL_PATH, fsync=SPILL_FSYNC,
+                 dead_letter_path=DEAD_LETTER_PATH):
+        self.session_factory = session_factory or database.AsyncSessionLocal
+        self.max_queue = max_queue
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.fsync = fsync
+        self.dead_letter_path = dead_letter_path
+        self._pending = deque()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self._stopping = False
+        self._counters = dict.fromkeys(
+            ("accepted", "rejected", "written", "batches", "failures", "spilled", "replayed", "dead_lettered"), 0
+        )
+
+    def submit(self, row):
+        # False when the queue is full; the caller sheds load rather than buffering without limit
+        if len(self._pending) >= self.max_queue:
+            self._counters["rejected"] += 1
+            return False
+        self._pending.append(row)
+        self._counters["accepted"] += 1
+        if len(self._pending) >= self.flush_size:
+            self._wakeup.set()
+        return True
+
+    async def start(self):
+        if self._task is None:
+            # Fresh primitives for the running loop (the app may be started more than once per process)
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Drain on shutdown: whatever the database won't take goes to the spill file
+        # The loop is asked to exit rather than cancelled, so a flush already under way completes
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self._pending:
+            logger.error("Shutting down with %d unwritten incident reports", len(self._pending))
+
+    def stats(self):
+        return {**self._counters, "queued": len(self._pending)}
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("Incident flush failed: %r", e)
+
+    async def flush(self):
+        async with self._flush_lock:
+            if self.spill_path and os.path.exists(self.spill_path) and not await self._replay():
+                # Database still down: keep new reports behind the spilled ones, in order
+                await self._spill_pending()
+                return
+            while self._pending:
+                batch = [self._pending.popleft() for _ in range(min(self.flush_size, len(self._pending)))]
+                try:
+                    unwritten = await self._write_batch(batch)
+                except BaseException:
+                    # Cancelled mid-write: the batch goes back on the queue instead of being lost
+                    self._pending.extendleft(reversed(batch))
+                    raise
+                if unwritten:
+                    # Back to the front of the queue; with a spill file, out of memory and onto disk
+                    self._pending.extendleft(reversed(unwritten))
+                    if self.spill_path:
+                        await self._spill_pending()
+                    return
+
+    async def _write_batch(self, rows):
+        # The rows still to write after a transient failure ([] once everything is written or dead-lettered)
+        try:
+            await self._write(rows)
+            return []
+        except PERMANENT_ERRORS as e:
+            logger.warning("Batch of %d incident reports refused, retrying one at a time: %r", len(rows), e)
+        except Exception as e:
+            self._counters["failures"] += 1
+            logger.warning("Writing %d incident reports failed: %r", len(rows), e)
+            return rows
+        # One bad row must not hold back the rest: find it and set it aside
+        for i, row in enumerate(rows):
+            try:
+                await self._write([row])
+            except PERMANENT_ERRORS as e:
+                await self._dead_letter(row, e)
+            except Exception as e:
+                self._counters["failures"] += 1
+                logger.warning("Writing incident reports failed: %r", e)
+                return rows[i:]
+        return []
+
+    async def _write(self, rows):
+        async with self.session_factory() as db:
+            with metrics.DB_QUERY_SECONDS.time("incident_flush"):
+                await db.execute(_insert(db.get_bind().dialect.name), rows)
+                await db.commit()
+        self._counters["written"] += len(rows)
+        self._counters["batches"] += 1
+
+    async def _spill_pending(self):
+        # Taken off the queue first: reports submitted while the file is written stay queued
+        rows = list(self._pending)
+        if not rows:
+            return
+        self._pending.clear()
+        try:
+            await asyncio.to_thread(self._append, self.spill_path, rows)
+        except OSError:
+            self._pending.extendleft(reversed(rows))
+            raise
+        self._counters["spilled"] += len(rows)
+
+    async def _dead_letter(self, row, error):
+        self._counters["dead_lettered"] += 1
+        logger.error("Incident report %s refused by the database, dropped: %r", row["id"], error)
+        if self.dead_letter_path:
+            try:
+                await asyncio.to_thread(self._append, self.dead_letter_path, [{**row, "error": repr(error)}])
+            except OSError as e:
+                logger.error("Writing incident report %s to the dead-letter file failed: %r", row["id"], e)
+
+    def _append(self, path, rows):
+        with open(path, "a") as f:
+            f.write("".join(_encode_row(row) + "\n" for row in rows))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    async def _replay(self):
+        # Idempotent: rows already committed by an earlier replay (say a crash before the file was
+        # removed) are skipped on their id, and refused rows are dead-lettered like any other batch
+        rows = await asyncio.to_thread(self._read_spill)
+        if rows and await self._write_batch(rows):
+            logger.warning("Replaying %d spilled incident reports failed", len(rows))
+            return False
+        os.remove(self.spill_path)
+        self._counters["replayed"] += len(rows)
+        return True
+
+    def _read_spill(self):
+        with open(self.spill_path) as f:
+            return [_decode_row(line) for line in f if line.strip()]
+
+writer = IncidentWriter()
@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from . import models
+
+logger = logging.getLogger(__name__)
+
+WINDOW_MINUTES = 60
+# Opt-in: the window lives in one process and only sees that process's writes, so it is
+# only correct with a single worker; multi-worker deployments keep the SQL aggregate
+WINDOW_ENABLED = os.environ.get("INCIDENT_WINDOW_ENABLED", "false").lower() in ("1", "true", "yes")
+
+def _minute(created_at):
+    # Naive timestamps are local time, matching the datetime.now() window used in SQL
+    if isinstance(created_at, datetime):
+        return int(created_at.timestamp() // 60)
+    return int(time.time() // 60)
+
+class _StationWindow:
+    __slots__ = ("buckets", "members", "count", "total")
+
+    def __init__(self):
+        self.buckets = {}   # minute -> set of incident ids
+        self.members = {}   # incident id -> (minute, severity)
+        self.count = 0
+        self.total = 0
+
+    def add(self, incident_id, minute, severity):
+        self.remove(incident_id)
+        self.buckets.setdefault(minute, set()).add(incident_id)
+        self.members[incident_id] = (minute, severity)
+        self.count += 1
+        self.total += severity
+
+    def remove(self, incident_id):
+        member = self.members.pop(incident_id, None)
+        if member is None:
+            return
+        minute, severity = member
+        bucket = self.buckets[minute]
+        bucket.discard(incident_id)
+        if not bucket:
+            del self.buckets[minute]
+        self.count -= 1
+        self.total -= severity
+
+    def expire(self, oldest_minute):
+        # At most WINDOW_MINUTES buckets are live, so this scan is bounded
+        for minute in [m for m in self.buckets if m < oldest_minute]:
+            for incident_id in self.buckets.pop(minute):
+                self.count -= 1
+                self.total -= self.members.pop(incident_id)[1]
+
+# Per-station rolling count/severity for the last hour, kept current by the incident routes.
+# Swap `window` for another object with the same methods to share state elsewhere.
+class IncidentWindow:
+    def __init__(self, minutes=WINDOW_MINUTES):
+        self.minutes = minutes
+        self._lock = threading.Lock()
+        self._stations = {}
+        self._seeded = set()
+        self._all_seeded = False
+
+    def is_seeded(self, station_code):
+        return self._all_seeded or station_code in self._seeded
+
+    def seed(self, rows, station_codes=None):
+        # rows: (id, station_code, created_at, severity); station_codes=None means every station
+        with self._lock:
+            for incident_id, station_code, created_at, severity in rows:
+                self._station(station_code).add(incident_id, _minute(created_at), severity)
+            if station_codes is None:
+                self._all_seeded = True
+            else:
+                self._seeded.update(station_codes)
+
+    def record(self, station_code, incident_id, created_at, severity, now=None):
+        oldest = int((now or time.time()) // 60) - self.minutes + 1
+        minute = _minute(created_at)
+        with self._lock:
+            station = self._station(station_code)
+            # Expire on write too, so stations nobody reads stay bounded to one window
+            station.expire(oldest)
+            if minute < oldest:
+                station.remove(incident_id)
+            else:
+                station.add(incident_id, minute, severity)
+
+    def discard(self, station_code, incident_id):
+        with self._lock:
+            station = self._stations.get(station_code)
+            if station is not None:
+                station.remove(incident_id)
+
+    def stats(self, station_code, now=None):
+        # (report_count, avg_severity), or None until the station has been seeded
+        if not self.is_seeded(station_code):
+            return None
+        current = int((now or time.time()) // 60)
+        with self._lock:
+            station = self._stations.get(station_code)
+            if station is None:
+                return 0, 0.0
+            station.expire(current - self.minutes + 1)
+            return station.count, (station.total / station.count if station.count else 0.0)
+
+    def reset(self):
+        with self._lock:
+            self._stations.clear()
+            self._seeded.clear()
+            self._all_seeded = False
+
+    def _station(self, station_code):
+        station = self._stations.get(station_code)
+        if station is None:
+            station = self._stations[station_code] = _StationWindow()
+        return station
+
+window = IncidentWindow()
+
+def recent_query(station_codes=None):
+    # Only the columns the window needs; descriptions never leave the database
+    since = datetime.now() - timedelta(minutes=WINDOW_MINUTES)
+    stmt = select(
+        models.Incident.id,
+        models.Incident.station_code,
+        models.Incident.created_at,
+        models.Incident.severity
+    ).where(models.Incident.created_at >= since)
+    if station_codes is not None:
+        stmt = stmt.where(models.Incident.station_code.in_(station_codes))
+    return stmt
+
+def load_recent(db: Session, station_codes=None):
+    return db.execute(recent_query(station_codes)).all()
+
+async def load_recent_async(db: AsyncSession, station_codes=None):
+    return (await db.execute(recent_query(station_codes))).all()
+
+def ensure_seeded(db: Session, station_codes):
+    missing = [c for c in station_codes if not window.is_seeded(c)]
+    if missing:
+        window.seed(load_recent(db, missing), missing)
+
+async def ensure_seeded_async(db: AsyncSession, station_codes):
+    missing = [c for c in station_codes if not window.is_seeded(c)]
+    if missing:
+        window.seed(await load_recent_async(db, missing), missing)
+
+def seed_all(db: Session):
+    window.reset()
+    window.seed(load_recent(db))
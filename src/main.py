@@ -1,14 +1,71 @@
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import SQLAlchemyError
 from fastapi.middleware.cors import CORSMiddleware
 from src.routers import auth
 import src.models as models
 import src.database as database
-from src.routers import incidents, analytics
+import src.rail_service as rail_service
+import src.incident_window as incident_window
+import src.incident_queue as incident_queue
+import src.auth as auth_service
+import src.metrics as metrics
+import src.shared_cache as shared_cache
+import src.rate_limit as rate_limit
+from src.board_poller import BoardPoller
+from src.health_history import HealthSampler
+from src.routers import incidents, analytics, streams
 
 # Create Tables
 models.Base.metadata.create_all(bind=database.engine)
 
-app = FastAPI(title="RailPulse API", version="2.0.0")
+logger = logging.getLogger(__name__)
+
+def seed_incident_window():
+    db = database.SessionLocal()
+    try:
+        incident_window.seed_all(db)
+    finally:
+        db.close()
+
+# Startup / Shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await rail_service.start_client()
+    # Load the last hour of reports so health reads never query the database
+    incident_window.window.reset()
+    if incident_window.WINDOW_ENABLED:
+        try:
+            await run_in_threadpool(seed_incident_window)
+        except SQLAlchemyError as e:
+            logger.warning("Incident window not seeded at startup, stations will seed on first read: %r", e)
+    # Pre-warm configured hubs (BOARD_POLL_STATIONS) off the request path
+    app.state.board_poller = BoardPoller()
+    await app.state.board_poller.start()
+    # Record hub health history (HEALTH_SNAPSHOT_STATIONS)
+    app.state.health_sampler = HealthSampler()
+    await app.state.health_sampler.start()
+    # Group-commit accepted reports (INCIDENT_WRITE_BEHIND)
+    if incident_queue.WRITE_BEHIND:
+        await incident_queue.writer.start()
+    yield
+    # Drain queued reports before the engine goes away
+    if incident_queue.WRITE_BEHIND:
+        await incident_queue.writer.stop()
+    await app.state.health_sampler.stop()
+    await app.state.board_poller.stop()
+    await rail_service.close_client()
+    shared_cache.cache.close()
+    await database.async_engine.dispose()
+
+app = FastAPI(title="RailPulse API", version="2.0.0", lifespan=lifespan)
+
+# Per-client default budget, checked before routing (inside CORS so browsers can read the 429)
+if rate_limit.RATE_LIMIT_ENABLED:
+    app.add_middleware(rate_limit.RateLimitMiddleware)
 
 # CORS
 app.add_middleware(
@@ -19,11 +76,44 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency histogram (outermost, so it covers CORS and routing too)
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# Upstream in-flight cap reached and no last-known-good board to fall back on
+@app.exception_handler(rail_service.UpstreamBusy)
+async def upstream_busy(request, exc):
+    return JSONResponse(
+        {"detail": "Upstream busy, retry shortly"}, status_code=503,
+        headers={"Retry-After": str(rail_service.HUXLEY_BUSY_RETRY_AFTER)},
+    )
+
 # Include Routers
 app.include_router(auth.router)
 app.include_router(incidents.router)
 app.include_router(analytics.router)
+app.include_router(streams.router)
 
 @app.get("/")
 def root():
-    return {"message": "RailPulse API is Online"}
\ No newline at end of file
+    return {"message": "RailPulse API is Online"}
+
+# Pool and cache counters for monitoring
+@app.get("/status")
+def status():
+    return {
+        "database": database.pool_stats(),
+        "board_cache": rail_service.board_cache.stats(),
+        "upstream_breakers": rail_service.breaker.stats(),
+        "upstream_slots": rail_service.upstream_slots.stats(),
+        "rate_limit": rate_limit.limiter.stats(),
+        "shared_cache": shared_cache.cache.stats(),
+        "board_poller": app.state.board_poller.status(),
+        "password_pool": auth_service.password_pool.stats(),
+        "incident_queue": incident_queue.writer.stats(),
+    }
+
+# Prometheus text exposition of latency histograms and error counters
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
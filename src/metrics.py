@@ -0,0 +1,219 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Metrics Configuration
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Label sets kept per metric; later ones (e.g. junk station codes) are folded into "other"
+METRICS_MAX_SERIES = int(os.environ.get("METRICS_MAX_SERIES", 1000))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+# Base for labelled series; one lock per metric, held only for a dict lookup and an add
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _get(self, labels):
+        series = self._series.get(labels)
+        if series is None:
+            if len(self._series) >= METRICS_MAX_SERIES:
+                labels = ("other",) * len(self.labelnames)
+                series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = self._new()
+        return series
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(labels, self._snapshot(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            lines.extend(self._lines(labels, series))
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new(self):
+        return [0]
+
+    def inc(self, *labels, amount=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._get(labels)[0] += amount
+
+    def value(self, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            return series[0] if series else 0
+
+    def _snapshot(self, series):
+        return series[0]
+
+    def _lines(self, labels, value):
+        return [f"{self.name}_total{_labels(self.labelnames, labels)} {value}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new(self):
+        # Per-bucket (non-cumulative) counts, then sum and count
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, value, *labels):
+        if not METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._get(labels)
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            return series[2] if series else 0
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def _snapshot(self, series):
+        return list(series[0]), series[1], series[2]
+
+    def _lines(self, labels, series):
+        counts, total, count = series
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in self.metrics:
+            metric.clear()
+
+registry = Registry()
+
+# Request level
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "railpulse_http_request_duration_seconds", "Time spent handling HTTP requests.", ("method", "route", "status")
+))
+
+# Upstream (Huxley)
+UPSTREAM_SECONDS = registry.register(Histogram(
+    "railpulse_upstream_request_duration_seconds", "Huxley board fetch time including retries.", ("station", "outcome")
+))
+UPSTREAM_ERRORS = registry.register(Counter(
+    "railpulse_upstream_errors", "Failed Huxley board fetches.", ("station", "error")
+))
+UPSTREAM_FALLBACKS = registry.register(Counter(
+    "railpulse_upstream_fallbacks", "Requests answered with the last-known-good (or empty) board.", ("station",)
+))
+UPSTREAM_SHORT_CIRCUITS = registry.register(Counter(
+    "railpulse_upstream_short_circuits", "Board fetches refused by an open circuit breaker.", ("station",)
+))
+
+# Admission control
+RATE_LIMITED = registry.register(Counter(
+    "railpulse_rate_limited", "Requests refused by a rate limit or the upstream in-flight cap.", ("budget",)
+))
+
+# Database, auth and request stages
+DB_QUERY_SECONDS = registry.register(Histogram(
+    "railpulse_db_query_duration_seconds", "Database round trips by query.", ("query",)
+))
+BCRYPT_SECONDS = registry.register(Histogram(
+    "railpulse_bcrypt_duration_seconds", "bcrypt hash/verify time on the password pool.", ("operation",),
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+))
+BCRYPT_WAIT_SECONDS = registry.register(Histogram(
+    "railpulse_bcrypt_queue_wait_seconds", "Time bcrypt calls waited for a free worker.", ("operation",)
+))
+AUTH_LOOKUPS = registry.register(Counter(
+    "railpulse_auth_lookups", "Principal resolutions by source (claims, cache, db).", ("source",)
+))
+SERIALISATION_SECONDS = registry.register(Histogram(
+    "railpulse_serialisation_duration_seconds", "Time rendering response bodies to bytes.", ("endpoint",)
+))
+HEALTH_STAGE_SECONDS = registry.register(Histogram(
+    "railpulse_health_stage_duration_seconds", "Hub health time per stage (board, crowd, scoring, serialise).", ("stage",)
+))
+
+# Pure ASGI middleware (no BaseHTTPMiddleware task/queue overhead); labels by route template
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status_code)
+            )
@@ -1,10 +1,18 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean
+from sqlalchemy import BigInteger, Column, Integer, String, Text, ForeignKey, DateTime, Boolean, Float, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.sqlite import DATETIME as SQLITE_DATETIME
 from sqlalchemy.sql import func
 import uuid
 from src.database import Base
 
+# SQLite's CURRENT_TIMESTAMP has no fractional seconds; bind parameters the same way
+# so keyset cursors compare equal to the stored value
+Timestamp = DateTime(timezone=True).with_variant(
+    SQLITE_DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite"
+)
+
 class User(Base):
     __tablename__ = "users"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -28,5 +36,32 @@ class Incident(Base):
     type = Column(String)
     severity = Column(Integer)
     description = Column(Text, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    station_code = Column(String, index=True, default="LDS")
\ No newline at end of file
+    created_at = Column(Timestamp, server_default=func.now())
+    station_code = Column(String, index=True, default="LDS")
+
+    # The one-hour health window becomes an index range scan per station;
+    # my-reports pages walk (owner_id, created_at, id) in index order
+    __table_args__ = (
+        Index("ix_incidents_station_created", "station_code", "created_at"),
+        Index("ix_incidents_owner_created", "owner_id", "created_at", "id"),
+    )
+
+class HubHealthSnapshot(Base):
+    __tablename__ = "hub_health_snapshots"
+    # Append-only and written in time order, so a BRIN index on sampled_at stays tiny
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    station_code = Column(String, nullable=False)
+    sampled_at = Column(Timestamp, nullable=False)
+    stress_index = Column(Float)
+    hub_status = Column(String)
+    cancellations = Column(Integer)
+    # Needed to re-apply the cancellation override when rescoring; NULL on older rows
+    total_trains = Column(Integer)
+    avg_delay = Column(Float)
+    passenger_reports = Column(Integer)
+    avg_report_severity = Column(Float)
+
+    __table_args__ = (
+        Index("ix_snapshots_station_sampled", "station_code", "sampled_at"),
+        Index("ix_snapshots_sampled_brin", "sampled_at", postgresql_using="brin"),
+    )
\ No newline at end of file
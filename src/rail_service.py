@@ -1,104 +1,542 @@
-import requests
+import asyncio
+import hashlib
+import httpx
 from dotenv import load_dotenv
 import os
-from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, fields, replace
+from typing import Optional, Tuple
+from . import delay_stats, fast_json, metrics, shared_cache
 
 load_dotenv()
 
-BASE_URL = "https://huxley2.azurewebsites.net"
+# Overridable so benchmarks can point at a local stand-in (benchmarks/fake_huxley.py)
+BASE_URL = os.environ.get("HUXLEY_BASE_URL", "https://huxley2.azurewebsites.net").rstrip("/")
 TOKEN = os.environ.get("OLDBWS_TOKEN")
 
-def get_live_arrivals(hub_code="LDS"):
+# Board Cache Configuration (seconds / entries)
+BOARD_CACHE_TTL = float(os.environ.get("BOARD_CACHE_TTL", 30))
+BOARD_CACHE_STALE_TTL = float(os.environ.get("BOARD_CACHE_STALE_TTL", 120))
+BOARD_CACHE_MAX_ENTRIES = int(os.environ.get("BOARD_CACHE_MAX_ENTRIES", 256))
+
+# Upstream HTTP Configuration
+HUXLEY_CONNECT_TIMEOUT = float(os.environ.get("HUXLEY_CONNECT_TIMEOUT", 3))
+HUXLEY_READ_TIMEOUT = float(os.environ.get("HUXLEY_READ_TIMEOUT", 10))
+HUXLEY_MAX_CONNECTIONS = int(os.environ.get("HUXLEY_MAX_CONNECTIONS", 20))
+HUXLEY_RETRIES = int(os.environ.get("HUXLEY_RETRIES", 2))
+HUXLEY_RETRY_BACKOFF = float(os.environ.get("HUXLEY_RETRY_BACKOFF", 0.25))
+
+# Circuit Breaker Configuration (consecutive failures / seconds before a recovery probe)
+HUXLEY_BREAKER_FAILURES = int(os.environ.get("HUXLEY_BREAKER_FAILURES", 5))
+HUXLEY_BREAKER_RESET = float(os.environ.get("HUXLEY_BREAKER_RESET", 30))
+
+# Admission Control: upstream fetches in flight per worker before new ones fail fast (0 = no cap)
+HUXLEY_MAX_INFLIGHT = int(os.environ.get("HUXLEY_MAX_INFLIGHT", 0))
+HUXLEY_BUSY_RETRY_AFTER = int(os.environ.get("HUXLEY_BUSY_RETRY_AFTER", 1))
+
+class _CacheEntry:
+    __slots__ = ("value", "stored_at")
+
+    def __init__(self, value, stored_at):
+        self.value = value
+        self.stored_at = stored_at
+
+# Per-station LRU cache with TTL, stale-while-revalidate and single-flight loads
+class BoardCache:
+    def __init__(self, ttl=BOARD_CACHE_TTL, stale_ttl=BOARD_CACHE_STALE_TTL, max_entries=BOARD_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ("hits", "stale_hits", "misses", "coalesced", "refreshes", "refresh_errors", "evictions"), 0
+        )
+
+    async def get_async(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = now - entry.stored_at
+                if age < self.ttl:
+                    self._counters["hits"] += 1
+                    self._entries.move_to_end(key)
+                    return entry.value
+                if age < self.ttl + self.stale_ttl:
+                    # Serve the old board and let a single background refresh replace it
+                    self._counters["stale_hits"] += 1
+                    self._entries.move_to_end(key)
+                    if key not in self._tasks:
+                        self._counters["refreshes"] += 1
+                        self._start_task(key, loader)
+                    return entry.value
+
+            task = self._tasks.get(key)
+            if task is not None:
+                self._counters["coalesced"] += 1
+            else:
+                self._counters["misses"] += 1
+                task = self._start_task(key, loader)
+
+        # Shield so one cancelled caller doesn't abort the fetch for everyone else
+        return await asyncio.shield(task)
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def contains(self, key):
+        # Whether get() would answer from memory (fresh or stale) without waiting on a load
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() - entry.stored_at < self.ttl + self.stale_ttl
+
+    def peek(self, key):
+        # Whatever is stored for key, however old (the last-known-good board); no counters touched
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry.value if entry is not None else None
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "inflight": len(self._tasks)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _start_task(self, key, loader):
+        task = self._tasks[key] = asyncio.ensure_future(self._load_async(key, loader))
+        # Background refreshes may never be awaited; mark their errors as retrieved
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def _load_async(self, key, loader):
+        try:
+            value = await loader(key)
+        except Exception:
+            with self._lock:
+                if key in self._entries:
+                    self._counters["refresh_errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._tasks.pop(key, None)
+        with self._lock:
+            self._store(key, value)
+        return value
+
+    def _store(self, key, value):
+        self._entries[key] = _CacheEntry(value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+board_cache = BoardCache()
+
+class CircuitOpen(Exception):
+    pass
+
+class UpstreamBusy(Exception):
+    pass
+
+class UpstreamSlots:
+    # Counting gate in front of upstream fetches; refuses instead of queueing
+    def __init__(self, limit=HUXLEY_MAX_INFLIGHT):
+        self.limit = limit
+        self._inflight = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.limit and self._inflight >= self.limit:
+                self._rejected += 1
+                return False
+            self._inflight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._inflight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"limit": self.limit, "inflight": self._inflight, "rejected": self._rejected}
+
+class _Circuit:
+    __slots__ = ("state", "failures", "opened_at", "probing")
+
+    def __init__(self):
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+# Per-station breaker: after `failure_threshold` consecutive errors calls fail fast for `reset_timeout`,
+# then a single half-open probe decides whether to close again
+class CircuitBreaker:
+    def __init__(self, failure_threshold=HUXLEY_BREAKER_FAILURES, reset_timeout=HUXLEY_BREAKER_RESET,
+                 max_entries=BOARD_CACHE_MAX_ENTRIES):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_entries = max_entries
+        # Only stations that are failing have an entry
+        self._circuits = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None or circuit.state == "closed":
+                return True
+            if circuit.state == "open" and time.monotonic() - circuit.opened_at >= self.reset_timeout:
+                circuit.state = "half_open"
+            if circuit.state == "half_open" and not circuit.probing:
+                circuit.probing = True
+                return True
+            return False
+
+    def record_success(self, key):
+        with self._lock:
+            self._circuits.pop(key, None)
+
+    def release(self, key):
+        # A probe that was cancelled before finishing; let the next caller probe instead
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is not None:
+                circuit.probing = False
+
+    def record_failure(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit is None:
+                circuit = self._circuits[key] = _Circuit()
+                while len(self._circuits) > self.max_entries:
+                    self._circuits.popitem(last=False)
+            self._circuits.move_to_end(key)
+            circuit.failures += 1
+            circuit.probing = False
+            if circuit.state == "half_open" or circuit.failures >= self.failure_threshold:
+                circuit.state = "open"
+                circuit.opened_at = time.monotonic()
+
+    def state(self, key):
+        with self._lock:
+            circuit = self._circuits.get(key)
+            return circuit.state if circuit is not None else "closed"
+
+    def stats(self):
+        with self._lock:
+            return {key: {"state": c.state, "failures": c.failures} for key, c in self._circuits.items()}
+
+    def clear(self):
+        with self._lock:
+            self._circuits.clear()
+
+breaker = CircuitBreaker()
+upstream_slots = UpstreamSlots()
+
+# Shared HTTP client (keep-alive pool reused across requests)
+_async_client = None
+
+def board_url(hub_code):
     # Using /all/ to capture both Arrivals and Departures
-    url = f"{BASE_URL}/all/{hub_code}/50?accessToken={TOKEN}&expand=true"
-    
+    return f"{BASE_URL}/all/{hub_code}/50?accessToken={TOKEN}&expand=true"
+
+async def start_client():
+    # Called from the app lifespan so every request shares one connection pool
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HUXLEY_READ_TIMEOUT, connect=HUXLEY_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HUXLEY_MAX_CONNECTIONS,
+                max_keepalive_connections=HUXLEY_MAX_CONNECTIONS,
+            ),
+        )
+    return _async_client
+
+async def close_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+async def fetch_board_async(hub_code="LDS"):
+    client = _async_client or await start_client()
+    attempt = 0
+    while True:
+        try:
+            response = await client.get(board_url(hub_code))
+            response.raise_for_status()
+            return parse_board(response.json(), hub_code)
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            # Only retry network faults and upstream 5xx; a 4xx won't fix itself
+            retryable = not isinstance(e, httpx.HTTPStatusError) or e.response.status_code >= 500
+            if not retryable or attempt >= HUXLEY_RETRIES:
+                raise
+            await asyncio.sleep(HUXLEY_RETRY_BACKOFF * (2 ** attempt))
+            attempt += 1
+
+async def load_board_async(hub_code):
+    # Cache loader: the fleet-wide copy when SHARED_CACHE_URL is set, so one worker fetches per TTL
+    if shared_cache.cache.enabled:
+        board = await shared_cache.cache.load_async(
+            f"board:{hub_code}", lambda: load_upstream_async(hub_code), encode_board, decode_board, BOARD_CACHE_TTL
+        )
+    else:
+        board = await load_upstream_async(hub_code)
+    # Every refresh feeds the delay distributions; re-recording an unchanged board is a no-op
+    delay_stats.stats.record_board(hub_code, board)
+    return board
+
+async def load_upstream_async(hub_code):
+    # One timed upstream fetch behind the in-flight cap and the station's breaker
+    _admit(hub_code)
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        
-        # 1. CAPTURE THE FULL STATION NAME
-        station_name = data.get("locationName", hub_code) 
-        
-        trains = data.get("trainServices")
-        if not trains:
-            return {"station_name": station_name, "trains": []}
+        _check_breaker(hub_code)
+        started = time.perf_counter()
+        try:
+            board = await fetch_board_async(hub_code)
+        except asyncio.CancelledError:
+            breaker.release(hub_code)
+            raise
+        except Exception as e:
+            _record_failure(hub_code, e, started)
+            raise
+        _record_success(hub_code, started)
+        return board
+    finally:
+        upstream_slots.release()
 
-        all_trains = []
-        
+def _admit(hub_code):
+    if not upstream_slots.acquire():
+        metrics.RATE_LIMITED.inc("upstream_inflight")
+        raise UpstreamBusy(hub_code)
+
+def _check_breaker(hub_code):
+    # An open circuit costs a lock and a raise, never a socket
+    if not breaker.allow(hub_code):
+        metrics.UPSTREAM_SHORT_CIRCUITS.inc(hub_code)
+        raise CircuitOpen(hub_code)
+
+def _record_success(hub_code, started):
+    breaker.record_success(hub_code)
+    metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - started, hub_code, "ok")
+
+def _record_failure(hub_code, error, started):
+    breaker.record_failure(hub_code)
+    metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - started, hub_code, "error")
+    metrics.UPSTREAM_ERRORS.inc(hub_code, type(error).__name__)
+
+# Compact per-train record; dicts are only built when departures are serialised
+@dataclass(slots=True, frozen=True)
+class Train:
+    from_code: str
+    from_name: str
+    scheduled: Optional[str]
+    estimated: Optional[str]
+    status: str
+    delay_weight: int
+    platform: Optional[str]
+    operator: Optional[str]
+    length: int
+    delay_reason: Optional[str]
+    train_id: Optional[str]
+
+    def as_dict(self):
+        return {
+            "from_code": self.from_code,
+            "from_name": self.from_name,
+            "origin_city": self.from_name,
+            "scheduled": self.scheduled,
+            "estimated": self.estimated,
+            "status": self.status,
+            "delay_weight": self.delay_weight,
+            "platform": self.platform,
+            "operator": self.operator,
+            # Refund Logic
+            "refund_eligible": self.delay_weight >= 15,
+            "length": self.length,
+            "delay_reason": self.delay_reason,
+            "train_id": self.train_id
+        }
+
+# A parsed station board with the aggregates hub health needs, computed once per fetch
+@dataclass(slots=True, frozen=True)
+class Board:
+    station_name: str
+    trains: Tuple[Train, ...]
+    cancelled: int = 0
+    active_delay_total: int = 0
+    # Content hash (stable across workers) and wall-clock fetch time, for HTTP caching
+    digest: str = ""
+    fetched_at: float = 0.0
+    # Served from the last-known-good copy because a fresh fetch failed (or no data at all)
+    degraded: bool = False
+
+    @classmethod
+    def from_trains(cls, station_name, trains, fetched_at=None):
+        trains = tuple(trains)
+        cancelled = 0
+        active_delay_total = 0
         for train in trains:
-            # Safe Origin Parsing
-            origin_list = train.get("origin", [])
-            if origin_list:
-                origin_crs = origin_list[0].get("crs")
-                origin_name = origin_list[0].get("locationName")
+            if train.status == "Cancelled":
+                cancelled += 1
             else:
-                origin_crs = "UNK"
-                origin_name = "Unknown Origin"
-            
-            # Time Parsing (Arrivals vs Starts)
-            sta = train.get("sta") 
-            eta = train.get("eta")
-            
-            if not sta:
-                sta = train.get("std")
-                eta = train.get("etd")
-            
-            status = "On Time"
-            delay_minutes = 0
-            
-            # Delay Logic
-            if eta == "Cancelled":
-                status = "Cancelled"
-                delay_minutes = 60 
-            elif eta == "On time":
-                status = "On Time"
-                delay_minutes = 0
-            elif eta and ":" in eta and sta and ":" in sta: 
-                try:
-                    t_sta = datetime.strptime(sta, "%H:%M")
-                    t_eta = datetime.strptime(eta, "%H:%M")
-                    diff_mins = (t_eta - t_sta).total_seconds() / 60.0
-                    
-                    if diff_mins < -720: diff_mins += 1440
-                    
-                    delay_minutes = max(0, int(diff_mins))
-                    if delay_minutes > 0: status = "Delayed"
-                except (ValueError, TypeError):
-                    delay_minutes = 0
+                active_delay_total += train.delay_weight
+        digest = hashlib.blake2b(repr((station_name, trains)).encode(), digest_size=12).hexdigest()
+        return cls(station_name, trains, cancelled, active_delay_total, digest,
+                   time.time() if fetched_at is None else fetched_at)
 
-            # Refund Logic
-            operator = train.get("operator", "")
-            refund_eligible = delay_minutes >= 15
-
-            all_trains.append({
-                "from_code": origin_crs,
-                "from_name": origin_name,
-                "origin_city": origin_name,
-                "scheduled": sta,
-                "estimated": eta,
-                "status": status,
-                "delay_weight": delay_minutes,
-                "platform": train.get("platform"),
-                "operator": operator,
-                "refund_eligible": refund_eligible,
-                "length": train.get("length", 0),
-                "delay_reason": train.get("delayReason"),
-                "train_id": train.get("serviceId")
-            })
+    @property
+    def avg_delay(self):
+        active = len(self.trains) - self.cancelled
+        return self.active_delay_total / active if active else 0
+
+    @property
+    def data_age(self):
+        # Seconds since Huxley produced this board; None when there never was one
+        return max(0.0, time.time() - self.fetched_at) if self.fetched_at else None
+
+    def departures(self):
+        return [train.as_dict() for train in self.trains]
+
+EMPTY_BOARD = Board("Unknown", (), degraded=True)
+
+_TRAIN_FIELDS = tuple(f.name for f in fields(Train))
+
+def encode_board(board):
+    # Shared-cache form: the parsed trains only; aggregates and the digest are rebuilt on decode
+    return fast_json.dumps({
+        "station_name": board.station_name,
+        "fetched_at": board.fetched_at,
+        "trains": [[getattr(train, name) for name in _TRAIN_FIELDS] for train in board.trains],
+    })
+
+def decode_board(data):
+    data = fast_json.loads(data)
+    trains = (Train(*values) for values in data["trains"])
+    return Board.from_trains(data["station_name"], trains, data["fetched_at"])
+
+def _minutes(hhmm):
+    # "HH:MM" -> minute of day without strptime; None for anything else ("Delayed", "", None)
+    if not hhmm or len(hhmm) != 5 or hhmm[2] != ":":
+        return None
+    hours, minutes = hhmm[:2], hhmm[3:]
+    if not (hours.isdigit() and minutes.isdigit()):
+        return None
+    hours, minutes = int(hours), int(minutes)
+    if hours > 23 or minutes > 59:
+        return None
+    return hours * 60 + minutes
+
+def parse_board(data, hub_code):
+    # 1. CAPTURE THE FULL STATION NAME
+    station_name = data.get("locationName", hub_code) 
+    
+    trains = data.get("trainServices")
+    if not trains:
+        return Board.from_trains(station_name, ())
+
+    all_trains = []
+    
+    for train in trains:
+        # Safe Origin Parsing
+        origin_list = train.get("origin", [])
+        if origin_list:
+            origin_crs = origin_list[0].get("crs")
+            origin_name = origin_list[0].get("locationName")
+        else:
+            origin_crs = "UNK"
+            origin_name = "Unknown Origin"
+        
+        # Time Parsing (Arrivals vs Starts)
+        sta = train.get("sta") 
+        eta = train.get("eta")
+        
+        if not sta:
+            sta = train.get("std")
+            eta = train.get("etd")
+        
+        status = "On Time"
+        delay_minutes = 0
+        
+        # Delay Logic (integer minute-of-day arithmetic, wrapping at midnight)
+        if eta == "Cancelled":
+            status = "Cancelled"
+            delay_minutes = 60 
+        elif eta != "On time":
+            t_sta = _minutes(sta)
+            t_eta = _minutes(eta)
+            if t_sta is not None and t_eta is not None:
+                diff_mins = t_eta - t_sta
+                if diff_mins < -720: diff_mins += 1440
                 
-        # 2. RETURN DICTIONARY (Fixes your error)
-        return {
-            "station_name": station_name,
-            "trains": all_trains
-        }
+                delay_minutes = max(0, diff_mins)
+                if delay_minutes > 0: status = "Delayed"
+
+        all_trains.append(Train(
+            origin_crs,
+            origin_name,
+            sta,
+            eta,
+            status,
+            delay_minutes,
+            train.get("platform"),
+            train.get("operator", ""),
+            train.get("length") or 0,
+            train.get("delayReason"),
+            train.get("serviceId")
+        ))
+            
+    return Board.from_trains(station_name, tuple(all_trains))
 
-    except Exception as e:
-        return {"station_name": "Unknown", "trains": []}
+def last_known_good(hub_code):
+    # The newest board ever fetched for the station, flagged degraded; EMPTY_BOARD if there is none
+    board = board_cache.peek(hub_code.upper())
+    if board is None or board is EMPTY_BOARD:
+        return EMPTY_BOARD
+    return replace(board, degraded=True)
+
+async def get_board_async(hub_code="LDS"):
+    # Raises on upstream failure so callers can report per-station errors
+    return await board_cache.get_async(hub_code.upper(), load_board_async)
+
+async def get_live_arrivals_async(hub_code="LDS"):
+    # Served from the board cache; concurrent misses share one upstream fetch
+    try:
+        return await get_board_async(hub_code)
+    except UpstreamBusy:
+        # Shed load with the last board if there is one; otherwise the caller answers 503
+        board = last_known_good(hub_code)
+        if board is EMPTY_BOARD:
+            raise
+        return board
+    except Exception:
+        # Already counted by the loader; this tracks responses served from the fallback
+        metrics.UPSTREAM_FALLBACKS.inc(hub_code.upper())
+        return last_known_good(hub_code)
+
+def get_live_arrivals(hub_code="LDS"):
+    # Blocking entry point for scripts; the app only uses the async path
+    async def run():
+        try:
+            return await get_live_arrivals_async(hub_code)
+        finally:
+            await close_client()
+    return asyncio.run(run())
 
 if __name__ == "__main__":
     print("Scanning for all trains (Arrivals & Departures)...\n")
     results = get_live_arrivals()
-    print(f"Found {len(results['trains'])} relevant trains.")
-    for t in results['trains']:
-        print(f" -> [{t['operator']}] {t['scheduled']} from {t['from_name']}: {t['status']} ({t['estimated']})")
\ No newline at end of file
+    print(f"Found {len(results.trains)} relevant trains.")
+    for t in results.trains:
+        print(f" -> [{t.operator}] {t.scheduled} from {t.from_name}: {t.status} ({t.estimated})")
\ No newline at end of file
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from fastapi import HTTPException, Request, status
+from fastapi.responses import JSONResponse
+from jose import JWTError, jwt
+from . import auth, metrics, rail_service, shared_cache
+
+logger = logging.getLogger(__name__)
+
+# Rate Limit Configuration: budgets are "<requests>/<seconds>", the request count doubling as the burst
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "false").lower() in ("1", "true", "yes")
+# Empty keeps counters per worker; any SHARED_CACHE_URL scheme makes limits hold across workers
+RATE_LIMIT_URL = os.environ.get("RATE_LIMIT_URL", "")
+RATE_LIMIT_DEFAULT = os.environ.get("RATE_LIMIT_DEFAULT", "300/60")
+RATE_LIMIT_LOGIN = os.environ.get("RATE_LIMIT_LOGIN", "10/60")
+RATE_LIMIT_UPSTREAM = os.environ.get("RATE_LIMIT_UPSTREAM", "30/60")
+# Key anonymous clients by the first X-Forwarded-For hop; only safe behind a proxy that sets it
+RATE_LIMIT_TRUST_PROXY = os.environ.get("RATE_LIMIT_TRUST_PROXY", "false").lower() in ("1", "true", "yes")
+EXEMPT_PATHS = {"/metrics"}
+
+def parse_budget(spec):
+    # "10/60" -> (6.0 seconds per token, burst of 10)
+    try:
+        count, seconds = spec.split("/")
+        count, seconds = int(count), float(seconds)
+        if count <= 0 or seconds <= 0:
+            raise ValueError(spec)
+    except ValueError:
+        raise ValueError(f"Rate limit budgets look like 10/60 (requests/seconds), got {spec!r}")
+    return seconds / count, count
+
+def client_key(scope):
+    # JWT subject when the request carries a valid token, otherwise the client address
+    headers = dict(scope.get("headers") or ())
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    if authorization[:7].lower() == "bearer ":
+        try:
+            subject = jwt.decode(authorization[7:], auth.SECRET_KEY, algorithms=[auth.ALGORITHM]).get("sub")
+        except JWTError:
+            subject = None
+        if subject:
+            return f"user:{subject}"
+    if RATE_LIMIT_TRUST_PROXY and b"x-forwarded-for" in headers:
+        return "ip:" + headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+# Token buckets per (budget, client) in a shared_cache store; store errors fail open
+class RateLimiter:
+    def __init__(self, store=None, budgets=None, prefix="ratelimit:"):
+        self.store = store if store is not None else shared_cache.MemoryStore()
+        self.budgets = budgets or {
+            "default": parse_budget(RATE_LIMIT_DEFAULT),
+            "login": parse_budget(RATE_LIMIT_LOGIN),
+            "upstream": parse_budget(RATE_LIMIT_UPSTREAM),
+        }
+        self.prefix = prefix
+        # The in-memory store is a dict under a lock; anything else is network or disk I/O
+        self._inline = isinstance(self.store, shared_cache.MemoryStore)
+        self._lock = threading.Lock()
+        self._counters = {"allowed": 0, "limited": 0, "errors": 0}
+
+    def take(self, budget, client, cost=1):
+        # Seconds until the client may retry; 0 means the request is allowed.
+        # A request never costs more than a full bucket, or it could never be allowed
+        interval, burst = self.budgets[budget]
+        cost = min(cost, burst)
+        try:
+            retry_after = self.store.take(f"{self.prefix}{budget}:{client}", time.time(), interval, burst, cost)
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Rate limit store failed, allowing request: %r", e)
+            return 0.0
+        if retry_after:
+            self._count("limited")
+            metrics.RATE_LIMITED.inc(budget)
+        else:
+            self._count("allowed")
+        return retry_after
+
+    async def take_async(self, budget, client, cost=1):
+        if self._inline:
+            return self.take(budget, client, cost)
+        return await asyncio.to_thread(self.take, budget, client, cost)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": type(self.store).__name__, **self._counters}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+limiter = RateLimiter(shared_cache.open_store(RATE_LIMIT_URL))
+
+def retry_after_header(seconds):
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+# Pure ASGI middleware applying the default budget to every request before routing
+class RateLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+        key = client_key(scope)
+        # Route budgets reuse the key instead of decoding the token again
+        scope.setdefault("state", {})["rate_limit_key"] = key
+        retry_after = await limiter.take_async("default", key)
+        if retry_after:
+            response = JSONResponse(
+                {"detail": "Rate limit exceeded"}, status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers=retry_after_header(retry_after),
+            )
+            return await response(scope, receive, send)
+        await self.app(scope, receive, send)
+
+async def charge(request: Request, budget: str, cost: int = 1):
+    if not RATE_LIMIT_ENABLED:
+        return
+    key = request.scope.get("state", {}).get("rate_limit_key") or client_key(request.scope)
+    retry_after = await limiter.take_async(budget, key, cost)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Rate limit exceeded",
+            headers=retry_after_header(retry_after),
+        )
+
+# DEPENDENCIES: separate budgets for expensive routes
+async def login_budget(request: Request):
+    # Every login or registration costs a bcrypt round on the password pool
+    await charge(request, "login")
+
+async def upstream_budget(station_code: str, request: Request):
+    # Only reads that would wait on Huxley spend it; boards already in memory are cheap
+    if not rail_service.board_cache.contains(station_code.upper()):
+        await charge(request, "upstream")
+
+async def charge_batch_upstream(request: Request, station_codes):
+    # Batch health fans out to Huxley: one upstream token per station not already in memory
+    misses = sum(not rail_service.board_cache.contains(code.upper()) for code in station_codes)
+    if misses:
+        await charge(request, "upstream", misses)
@@ -1,74 +1,306 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import DateTime, Integer, cast, func, select, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta
-from typing import List
-from .. import models, schemas, database, rail_service
+from typing import List, Optional
+from pydantic import TypeAdapter
+import asyncio
+import hashlib
+import math
+import os
+import re
+import time
+from .. import models, schemas, database, rail_service, hub_health, fast_json, metrics, scoring, delay_stats, rate_limit
 
 router = APIRouter(tags=["Analytics"])
 
-@router.get("/live/departures/{station_code}", response_model=List[schemas.TrainResponse])
-def get_live_departures(station_code: str):
+# Batch Limits
+BATCH_MAX_STATIONS = int(os.environ.get("BATCH_MAX_STATIONS", 100))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 10))
+
+# Health payloads memoised by ETag so a 200 for a given tag always carries the same body (the
+# timestamp and data age are added per response); with FAST_JSON the rendered bytes are kept alongside
+_health_memo = fast_json.Memo()
+_render_memo = fast_json.Memo()
+departures_adapter = TypeAdapter(List[schemas.TrainResponse])
+
+# History Limits
+HISTORY_MAX_POINTS = int(os.environ.get("HISTORY_MAX_POINTS", 500))
+HISTORY_DEFAULT_RANGE = timedelta(hours=24)
+BUCKET_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_bucket(bucket: str, name: str = "bucket"):
+    match = re.fullmatch(r"(\d+)([smhd])", bucket)
+    if not match or int(match.group(1)) == 0:
+        raise HTTPException(status_code=400, detail=f"{name} must look like 30s, 5m, 1h or 1d")
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2)]
+
+def bucket_start(column, bucket_seconds: int, dialect: str):
+    # Floor each timestamp to its bucket inside the database
+    if dialect == "sqlite":
+        epoch = cast(func.strftime("%s", column), Integer)
+        return type_coerce(func.datetime((epoch // bucket_seconds) * bucket_seconds, "unixepoch"), DateTime())
+    epoch = func.extract("epoch", column)
+    return func.to_timestamp(func.floor(epoch / bucket_seconds) * bucket_seconds)
+
+async def get_history(db: AsyncSession, station_code: str, start: datetime, end: datetime, bucket_seconds: int):
+    snapshot = models.HubHealthSnapshot
+    bucket = bucket_start(snapshot.sampled_at, bucket_seconds, db.get_bind().dialect.name).label("bucket")
+    with metrics.DB_QUERY_SECONDS.time("hub_history"):
+        rows = (await db.execute(select(
+            bucket,
+            func.count(snapshot.id),
+            func.avg(snapshot.stress_index),
+            func.max(snapshot.stress_index),
+            func.max(snapshot.cancellations),
+            func.avg(snapshot.avg_delay),
+            func.max(snapshot.passenger_reports)
+        ).where(
+            snapshot.station_code == station_code,
+            snapshot.sampled_at >= start,
+            snapshot.sampled_at < end
+        ).group_by(bucket).order_by(bucket))).all()
+    return [{
+        "bucket_start": bucket_time,
+        "samples": samples,
+        "avg_stress_index": round(avg_score, 2),
+        "max_stress_index": round(max_score, 2),
+        "max_cancellations": max_cancelled,
+        "avg_delay": round(avg_delay, 1),
+        "max_passenger_reports": max_reports
+    } for bucket_time, samples, avg_score, max_score, max_cancelled, avg_delay, max_reports in rows]
+
+def score_hub_health(station_code: str, board: rail_service.Board, report_count: int, avg_severity: float):
+    # The body only; callers stamp hub_health.freshness() per response
+    with metrics.HEALTH_STAGE_SECONDS.time("scoring"):
+        return hub_health.compute_health_body(station_code, board, report_count, avg_severity)
+
+def cache_headers(board: rail_service.Board, etag: Optional[str]):
+    # A failed fetch must never be cached downstream
+    if etag is None:
+        return {"Cache-Control": "no-store"}
+    # Last-known-good data: usable, but caches must come back every time
+    if board.degraded:
+        return {"ETag": etag, "Cache-Control": "no-cache"}
+    cache = rail_service.board_cache
+    max_age = max(0, int(cache.ttl - (time.time() - board.fetched_at)))
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}, stale-while-revalidate={int(cache.stale_ttl)}"
+    }
+
+def etag_matches(request: Request, etag: Optional[str]):
+    header = request.headers.get("if-none-match")
+    if not header or etag is None:
+        return False
+    # Weak comparison, as If-None-Match requires: W/"x" and "x" match each other
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+def board_etag(board: rail_service.Board):
+    return None if board is rail_service.EMPTY_BOARD else f'"{board.digest}"'
+
+def health_etag(station_code: str, board: rail_service.Board, report_count: int, avg_severity: float):
+    if board is rail_service.EMPTY_BOARD:
+        return None
+    # Weak: the timestamp and data age differ on every response, so bodies are equivalent, not identical
+    key = f"{station_code}|{board.digest}|{board.degraded}|{report_count}|{avg_severity:.6f}"
+    return f'W/"{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"'
+
+def freshness_headers(board: rail_service.Board):
+    # Departures are a bare list, so data age and the degraded flag also travel as headers
+    age = board.data_age
+    headers = {"X-Data-Degraded": "true" if board.degraded else "false"}
+    if age is not None:
+        headers["X-Data-Age-Seconds"] = str(int(age))
+    return headers
+
+def render_departures(board: rail_service.Board):
+    with metrics.SERIALISATION_SECONDS.time("departures"):
+        trains = departures_adapter.validate_python(board.departures())
+        if fast_json.orjson is not None:
+            return fast_json.dumps([t.model_dump() for t in trains])
+        return departures_adapter.dump_json(trains)
+
+def render_health(payload):
+    with metrics.SERIALISATION_SECONDS.time("health"), metrics.HEALTH_STAGE_SECONDS.time("serialise"):
+        return fast_json.dumps(payload)
+
+@router.get("/live/departures/{station_code}", response_model=List[schemas.TrainResponse],
+            dependencies=[Depends(rate_limit.upstream_budget)])
+async def get_live_departures(station_code: str, request: Request, response: Response):
     # Fetch the full data
-    data = rail_service.get_live_arrivals(hub_code=station_code)
-    # Return the list of trains
-    return data.get("trains", [])
+    board = await rail_service.get_live_arrivals_async(hub_code=station_code)
+    etag = board_etag(board)
+    headers = {**cache_headers(board, etag), **freshness_headers(board)}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    if fast_json.FAST_JSON and etag is not None:
+        # Validated and rendered once per board snapshot, then served as bytes
+        body = _render_memo.get_or_create(("departures", etag), lambda: render_departures(board))
+        return fast_json.FastJSONResponse(body, headers=headers)
+    response.headers.update(headers)
+    # Return the list of trains (built only here, at serialisation time)
+    return board.departures()
 
-@router.get("/analytics/{station_code}/health")
-def get_hub_health(station_code: str, db: Session = Depends(database.get_db)):
-    # Fetch Data 
-    service_response = rail_service.get_live_arrivals(hub_code=station_code)
-    
-    # Get data with defaults
-    rail_data = service_response.get("trains", [])       
-    full_station_name = service_response.get("station_name", "Unknown Station")
-
-    # Fetch User Reports
-    one_hour_ago = datetime.now() - timedelta(hours=1)
-    recent_reports = db.query(models.Incident).filter(
-        models.Incident.created_at >= one_hour_ago,
-        models.Incident.station_code == station_code 
-    ).all()
-
-    # Calculate Rail Metrics
-    cancelled_trains = len([t for t in rail_data if t['status'] == 'Cancelled'])
-    
-    active_trains = [t for t in rail_data if t['status'] != 'Cancelled']
-    avg_delay = 0
-    if active_trains:
-        avg_delay = sum(t['delay_weight'] for t in active_trains) / len(active_trains)
+@router.get("/analytics/health")
+async def get_batch_health(
+    request: Request,
+    stations: str = Query(..., description="Comma-separated CRS codes, e.g. LDS,MAN,YRK"),
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    return await batch_health(stations.split(","), db, request)
 
-    # Crowd Metrics
-    avg_severity = 0
-    if recent_reports:
-        avg_severity = sum(r.severity for r in recent_reports) / len(recent_reports)
-
-    # Score Algorithm (0.0 - 1.0)
-    score = (avg_severity / 5.0 * 0.4) + (min(avg_delay, 60) / 60.0 * 0.6)
-    
-    # Determine Status Band
-    status = "GREEN"
-    if score > 0.7: status = "RED"
-    elif score > 0.35: status = "AMBER"
-    
-    # Domain Override
-    if cancelled_trains > (len(rail_data) * 0.25): 
-        status = "Amber"
-        score = max(score, 0.35)
-    elif cancelled_trains > (len(rail_data) * 0.5):
-        status = "Red"
-        score = max(score, 0.7)
-    
+@router.post("/analytics/health")
+async def post_batch_health(body: schemas.BatchHealthRequest, request: Request,
+                            db: AsyncSession = Depends(database.get_read_db)):
+    return await batch_health(body.stations, db, request)
+
+async def batch_health(station_codes: List[str], db: AsyncSession, request: Request):
+    # Deduplicate while keeping the caller's order
+    codes = list(dict.fromkeys(c.strip() for c in station_codes if c.strip()))
+    if not codes:
+        raise HTTPException(status_code=400, detail="No station codes supplied")
+    if len(codes) > BATCH_MAX_STATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_STATIONS} stations per request")
+    await rate_limit.charge_batch_upstream(request, codes)
 
+    limiter = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def fetch(code):
+        async with limiter:
+            try:
+                return await rail_service.get_board_async(code)
+            except Exception:
+                # Fall back to the last-known-good board; only stations never seen are errors
+                board = rail_service.last_known_good(code)
+                if board is rail_service.EMPTY_BOARD:
+                    raise
+                return board
+
+    # Upstream fan-out and the crowd metrics lookup run side by side
+    report_stats, boards = await asyncio.gather(
+        hub_health.get_crowd_stats(db, codes),
+        asyncio.gather(*(fetch(c) for c in codes), return_exceptions=True)
+    )
+
+    live, errors = [], []
+    for code, board in zip(codes, boards):
+        if isinstance(board, Exception):
+            errors.append({"station_code": code, "detail": f"Live data unavailable: {type(board).__name__}"})
+            continue
+        live.append((code, board, *report_stats.get(code, (0, 0))))
+
+    # Every station scored in one pass
+    scores = scoring.score_batch(
+        [severity for _, _, _, severity in live],
+        [board.avg_delay for _, board, _, _ in live],
+        [board.cancelled for _, board, _, _ in live],
+        [len(board.trains) for _, board, _, _ in live]
+    ).tolist()
+    results = [
+        hub_health.health_payload(code, board, report_count, avg_severity, score, status)
+        for (code, board, report_count, avg_severity), score, status in zip(live, *scores)
+    ]
+
+    return {"timestamp": datetime.now(), "results": results, "errors": errors}
+
+def parse_delay_window(window: str):
+    window_seconds = parse_bucket(window, "window")
+    if window_seconds > delay_stats.DELAY_RETENTION_SECONDS:
+        raise HTTPException(status_code=400, detail=f"window is limited to {delay_stats.DELAY_RETENTION_SECONDS}s")
+    return window_seconds
+
+@router.get("/analytics/delays")
+async def get_network_delays(
+    stations: Optional[str] = Query(None, description="Comma-separated CRS codes; every tracked station when omitted"),
+    window: str = "1h"
+):
+    # Merged from the per-bucket sketches kept as boards refresh; no boards are fetched here
+    window_seconds = parse_delay_window(window)
+    codes = list(dict.fromkeys(c.strip().upper() for c in stations.split(",") if c.strip())) if stations else None
+    return delay_stats.stats.summary(codes, window_seconds)
+
+@router.get("/analytics/{station_code}/delays", dependencies=[Depends(rate_limit.upstream_budget)])
+async def get_station_delays(station_code: str, window: str = "1h"):
+    window_seconds = parse_delay_window(window)
+    station_code = station_code.upper()
+    # Make sure the current board has been seen (usually a cache hit)
+    await rail_service.get_live_arrivals_async(hub_code=station_code)
+    summary = delay_stats.stats.summary([station_code], window_seconds)
+    return {"station_code": station_code, "window_seconds": window_seconds, **summary["stations"][station_code]}
+
+@router.get("/analytics/{station_code}/history")
+async def get_hub_history(
+    station_code: str,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    bucket: str = "5m",
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    end = end or datetime.now()
+    start = start or end - HISTORY_DEFAULT_RANGE
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+
+    # Widen the bucket when the range would return more than HISTORY_MAX_POINTS
+    bucket_seconds = parse_bucket(bucket)
+    span = (end - start).total_seconds()
+    bucket_seconds = max(bucket_seconds, math.ceil(span / HISTORY_MAX_POINTS))
+
+    points = await get_history(db, station_code, start, end, bucket_seconds)
     return {
-        "station": full_station_name, 
         "station_code": station_code,
-        "timestamp": datetime.now(),
-        "hub_status": status,
-        "stress_index": round(score, 2),
-        "metrics": {
-            "cancellations": cancelled_trains,
-            "avg_delay": round(avg_delay, 1),
-            "passenger_reports": len(recent_reports),
-            "avg_report_severity": round(avg_severity, 1)
-        }
-    }
\ No newline at end of file
+        "from": start,
+        "to": end,
+        "bucket_seconds": bucket_seconds,
+        "points": points
+    }
+
+@router.post("/analytics/rescore", response_model=schemas.RescoreResponse)
+async def what_if_rescore(request: schemas.RescoreRequest, db: AsyncSession = Depends(database.get_read_db)):
+    # Scores stored snapshots under alternative weights/thresholds; never writes
+    end = request.end or datetime.now()
+    if request.start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+    cfg = scoring.with_overrides(**request.model_dump())
+    stations = [c.strip().upper() for c in request.stations if c.strip()] if request.stations else None
+    try:
+        return await hub_health.rescore_snapshots(db, request.start, end, stations, cfg)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/analytics/{station_code}/health", dependencies=[Depends(rate_limit.upstream_budget)])
+async def get_hub_health(
+    station_code: str,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(database.get_read_db)
+):
+    # Fetch Data 
+    with metrics.HEALTH_STAGE_SECONDS.time("board"):
+        board = await rail_service.get_live_arrivals_async(hub_code=station_code)
+
+    # Crowd Metrics
+    with metrics.HEALTH_STAGE_SECONDS.time("crowd"):
+        report_stats = await hub_health.get_crowd_stats(db, [station_code])
+    report_count, avg_severity = report_stats[station_code]
+
+    # Conditional response: the tag covers both the board snapshot and the crowd metrics
+    etag = health_etag(station_code, board, report_count, avg_severity)
+    headers = {**cache_headers(board, etag), **freshness_headers(board)}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    fresh = hub_health.freshness(board)
+    if etag is None or board.degraded:
+        response.headers.update(headers)
+        return {**score_hub_health(station_code, board, report_count, avg_severity), **fresh}
+    # Memoised without the timestamp and data age, which are stamped on every response
+    payload = _health_memo.get_or_create(
+        etag, lambda: score_hub_health(station_code, board, report_count, avg_severity)
+    )
+    if fast_json.FAST_JSON:
+        body = _render_memo.get_or_create(("health", etag), lambda: render_health(payload))
+        return fast_json.FastJSONResponse(fast_json.extend(body, fresh), headers=headers)
+    response.headers.update(headers)
+    return {**payload, **fresh}
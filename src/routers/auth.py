@@ -1,29 +1,40 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from .. import models, schemas, database, auth
+from .. import models, schemas, database, auth, rate_limit
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
-@router.post("/register", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED)
-def register_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    if db.query(models.User).filter(models.User.email == user.email).first():
+def get_user_by_email(db: Session, email: str):
+    return db.query(models.User).filter(models.User.email == email).first()
+
+def save_user(db: Session, user: models.User):
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+# Blocking Session work runs in the threadpool; bcrypt runs in auth.password_pool
+@router.post("/register", response_model=schemas.UserResponse, status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(rate_limit.login_budget)])
+async def register_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+    if await run_in_threadpool(get_user_by_email, db, user.email):
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_pwd = auth.get_password_hash(user.password)
+    hashed_pwd = await auth.get_password_hash_async(user.password)
     new_user = models.User(email=user.email, hashed_password=hashed_pwd)
-    db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    new_user = await run_in_threadpool(save_user, db, new_user)
+    auth.invalidate_user(new_user.email)
     return new_user
 
-@router.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+@router.post("/login", dependencies=[Depends(rate_limit.login_budget)])
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
     # OAuth2PasswordRequestForm expects 'username' and 'password' fields
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+    user = await run_in_threadpool(get_user_by_email, db, form_data.username)
+    if not user or not await auth.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     # Create Token
-    access_token = auth.create_access_token(data={"sub": user.email})
+    access_token = auth.create_access_token(data=auth.token_claims(user))
     return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
@@ -1,40 +1,181 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import and_, insert, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import List, Optional
+import base64
+import json
+import os
 import uuid
-from .. import models, schemas, database, auth
+from .. import models, schemas, database, auth, incident_window, incident_queue, metrics
 
 router = APIRouter(prefix="/incidents", tags=["Incidents"])
 
+# Paging Limits
+MY_REPORTS_DEFAULT_LIMIT = int(os.environ.get("MY_REPORTS_DEFAULT_LIMIT", 100))
+MY_REPORTS_MAX_LIMIT = int(os.environ.get("MY_REPORTS_MAX_LIMIT", 1000))
+STREAM_BATCH_SIZE = 500
+BULK_MAX_INCIDENTS = int(os.environ.get("BULK_MAX_INCIDENTS", 500))
+
+def encode_cursor(incident: models.Incident):
+    raw = f"{incident.created_at.isoformat()}|{incident.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, incident_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(incident_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Keep the hub health rolling window in step with committed writes
+def record_in_window(incident):
+    if incident_window.WINDOW_ENABLED:
+        incident_window.window.record(incident.station_code, incident.id, incident.created_at, incident.severity)
+
 @router.post("/", response_model=schemas.IncidentResponse, status_code=status.HTTP_201_CREATED)
-def create_incident(
+async def create_incident(
     incident: schemas.IncidentCreate, 
+    response: Response,
     # SECURE: Get user from token automatically
-    current_user: models.User = Depends(auth.get_current_user), 
-    db: Session = Depends(database.get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user), 
+    db: AsyncSession = Depends(database.get_async_db)
 ):
+    if incident_queue.WRITE_BEHIND:
+        # Acknowledged once validated; the background writer group-commits it shortly after
+        row = {**incident.model_dump(), "id": uuid.uuid4(), "owner_id": current_user.id, "created_at": datetime.now()}
+        if not incident_queue.writer.submit(row):
+            raise HTTPException(status_code=503, detail="Too many pending reports, retry shortly",
+                                headers={"Retry-After": "1"})
+        if incident_window.WINDOW_ENABLED:
+            incident_window.window.record(row["station_code"], row["id"], row["created_at"], row["severity"])
+        response.status_code = status.HTTP_202_ACCEPTED
+        return row
+
     # We don't need to check if user exists; auth.get_current_user does that.
     new_report = models.Incident(**incident.dict(), owner_id=current_user.id)
     db.add(new_report)
-    db.commit()
-    db.refresh(new_report)
+    with metrics.DB_QUERY_SECONDS.time("create_incident"):
+        await db.commit()
+        await db.refresh(new_report)
+    record_in_window(new_report)
     return new_report
 
+def parse_bulk_body(body: bytes, content_type: str):
+    # JSON array, or one JSON object per line for application/x-ndjson
+    if content_type.startswith("application/x-ndjson"):
+        try:
+            lines = body.decode().splitlines()
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="NDJSON body must be UTF-8")
+        items = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
+    try:
+        items = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    return items
+
+@router.post("/bulk", response_model=schemas.BulkIncidentResponse, status_code=status.HTTP_201_CREATED)
+async def create_incidents_bulk(
+    request: Request,
+    response: Response,
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    items = parse_bulk_body(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > BULK_MAX_INCIDENTS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_INCIDENTS} incidents per upload")
+
+    # Validate everything up front so one bad report doesn't sink the batch
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            valid = schemas.IncidentCreate.model_validate(item)
+        except ValidationError as e:
+            detail = "; ".join(f"{'.'.join(map(str, err['loc'])) or 'item'}: {err['msg']}" for err in e.errors())
+            errors.append({"index": index, "detail": detail})
+            continue
+        rows.append({**valid.model_dump(), "owner_id": current_user.id})
+
+    created = []
+    if rows:
+        with metrics.DB_QUERY_SECONDS.time("bulk_insert"):
+            created = await insert_incidents(db, rows)
+        for incident in created:
+            record_in_window(incident)
+    else:
+        response.status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    return {"created": created, "errors": errors}
+
+async def insert_incidents(db: AsyncSession, rows: List[dict]):
+    # One multi-row INSERT ... RETURNING inside a single transaction
+    returned = (await db.scalars(
+        insert(models.Incident).returning(models.Incident, sort_by_parameter_order=True),
+        rows
+    )).all()
+    # Snapshot before commit expires the instances (avoids a refresh per row)
+    created = [schemas.IncidentResponse.model_validate(incident) for incident in returned]
+    await db.commit()
+    return created
+
 @router.get("/my-reports", response_model=List[schemas.IncidentResponse])
-def get_my_incidents(
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+async def get_my_incidents(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MY_REPORTS_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_read_db)
 ):
-    return db.query(models.Incident).filter(models.Incident.owner_id == current_user.id).all()
+    # Newest first; (created_at, id) is unique so the cursor never skips or repeats a row
+    stmt = select(models.Incident).where(models.Incident.owner_id == current_user.id)
+    if cursor:
+        created_at, incident_id = decode_cursor(cursor)
+        stmt = stmt.where(or_(
+            models.Incident.created_at < created_at,
+            and_(models.Incident.created_at == created_at, models.Incident.id < incident_id)
+        ))
+    stmt = stmt.order_by(models.Incident.created_at.desc(), models.Incident.id.desc())
+
+    if format == "ndjson":
+        # Server-side cursor: rows are fetched and written in batches, never held all at once
+        if limit:
+            stmt = stmt.limit(limit)
+        async def stream():
+            rows = await db.stream_scalars(stmt.execution_options(yield_per=STREAM_BATCH_SIZE))
+            async for row in rows:
+                yield schemas.IncidentResponse.model_validate(row).model_dump_json() + "\n"
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    limit = limit or MY_REPORTS_DEFAULT_LIMIT
+    with metrics.DB_QUERY_SECONDS.time("my_reports"):
+        rows = (await db.scalars(stmt.limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1])
+    return rows
 
 @router.put("/{incident_id}", response_model=schemas.IncidentResponse)
-def update_incident(
+async def update_incident(
     incident_id: uuid.UUID, 
     update_data: schemas.IncidentUpdate, 
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    incident = db.query(models.Incident).filter(models.Incident.id == incident_id).first()
+    with metrics.DB_QUERY_SECONDS.time("incident_get"):
+        incident = await db.get(models.Incident, incident_id)
     if not incident:
         raise HTTPException(status_code=404, detail="Incident not found")
     
@@ -46,21 +187,28 @@ def update_incident(
     if update_data.severity: incident.severity = update_data.severity
     if update_data.description: incident.description = update_data.description
     
-    db.commit()
-    db.refresh(incident)
+    with metrics.DB_QUERY_SECONDS.time("update_incident"):
+        await db.commit()
+        await db.refresh(incident)
+    record_in_window(incident)
     return incident
 
 @router.delete("/{incident_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_incident(
+async def delete_incident(
     incident_id: uuid.UUID, 
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(database.get_db)
+    current_user: auth.Principal = Depends(auth.get_current_user),
+    db: AsyncSession = Depends(database.get_async_db)
 ):
-    incident = db.query(models.Incident).filter(models.Incident.id == incident_id).first()
+    with metrics.DB_QUERY_SECONDS.time("incident_get"):
+        incident = await db.get(models.Incident, incident_id)
     if not incident:
         raise HTTPException(status_code=404, detail="Incident not found")
     if incident.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
-    db.delete(incident)
-    db.commit()
+    station_code, incident_id = incident.station_code, incident.id
+    with metrics.DB_QUERY_SECONDS.time("delete_incident"):
+        await db.delete(incident)
+        await db.commit()
+    if incident_window.WINDOW_ENABLED:
+        incident_window.window.discard(station_code, incident_id)
     return None
\ No newline at end of file
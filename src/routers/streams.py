@@ -0,0 +1,69 @@
+from fastapi import APIRouter, HTTPException, WebSocket
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+import asyncio
+import json
+from .. import health_stream
+
+router = APIRouter(tags=["Analytics"])
+
+# SSE comment sent when nothing changed, so proxies keep the connection open
+KEEPALIVE_SECONDS = 15
+
+@router.get("/analytics/{station_code}/stream")
+async def stream_hub_health(station_code: str):
+    try:
+        station_code = health_stream.normalise_station(station_code)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Subscribe before the response starts so a full station gets a proper 503
+    try:
+        queue = health_stream.hub.open(station_code)
+    except health_stream.StreamFull:
+        raise HTTPException(status_code=503, detail="Too many live subscribers for this station",
+                            headers={"Retry-After": "30"})
+
+    async def events():
+        try:
+            while True:
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: health\ndata: {json.dumps(jsonable_encoder(payload))}\n\n"
+        finally:
+            health_stream.hub.close(station_code, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.websocket("/analytics/{station_code}/ws")
+async def websocket_hub_health(websocket: WebSocket, station_code: str):
+    try:
+        station_code = health_stream.normalise_station(station_code)
+    except ValueError:
+        # 1008 = Policy Violation
+        await websocket.close(code=1008)
+        return
+    try:
+        queue = health_stream.hub.open(station_code)
+    except health_stream.StreamFull:
+        # 1013 = Try Again Later
+        await websocket.close(code=1013)
+        return
+
+    await websocket.accept()
+
+    async def pump():
+        while True:
+            await websocket.send_json(jsonable_encoder(await queue.get()))
+
+    sender = asyncio.create_task(pump())
+    try:
+        # Clients don't send anything; reading just tells us when they leave
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        sender.cancel()
+        health_stream.hub.close(station_code, queue)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, ConfigDict
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Dict, Optional, List
 from datetime import datetime
 import uuid
 
@@ -52,4 +52,39 @@ class TrainResponse(BaseModel):
     operator: Optional[str] = None
     length: int = 0
     refund_eligible: bool = False
-    train_id: Optional[str] = None
\ No newline at end of file
+    train_id: Optional[str] = None
+
+class BatchHealthRequest(BaseModel):
+    stations: List[str]
+
+# What-if rescoring of stored snapshots; unset weights/thresholds keep the live configuration
+class RescoreRequest(BaseModel):
+    start: datetime = Field(alias="from")
+    end: Optional[datetime] = Field(None, alias="to")
+    stations: Optional[List[str]] = None
+    severity_weight: Optional[float] = None
+    delay_weight: Optional[float] = None
+    delay_cap: Optional[float] = Field(None, gt=0)
+    amber_threshold: Optional[float] = None
+    red_threshold: Optional[float] = None
+    cancel_amber_ratio: Optional[float] = None
+    cancel_red_ratio: Optional[float] = None
+    model_config = ConfigDict(populate_by_name=True)
+
+class RescoreResponse(BaseModel):
+    rows: int
+    changed: int
+    written: bool
+    mean_stress_index: Optional[float] = None
+    previous_mean_stress_index: Optional[float] = None
+    status_counts: Dict[str, int]
+    previous_status_counts: Dict[str, int]
+
+
+class BulkItemError(BaseModel):
+    index: int
+    detail: str
+
+class BulkIncidentResponse(BaseModel):
+    created: List[IncidentResponse]
+    errors: List[BulkItemError]
@@ -0,0 +1,91 @@
+import os
+from dataclasses import dataclass, fields, replace
+from typing import NamedTuple
+
+# Optional dependency: NumPy vectorises batch scoring; a plain loop is used otherwise
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Stress Index Configuration (defaults are the published algorithm)
+SCORE_SEVERITY_WEIGHT = float(os.environ.get("SCORE_SEVERITY_WEIGHT", 0.4))
+SCORE_DELAY_WEIGHT = float(os.environ.get("SCORE_DELAY_WEIGHT", 0.6))
+SCORE_DELAY_CAP = float(os.environ.get("SCORE_DELAY_CAP", 60))
+SCORE_AMBER_THRESHOLD = float(os.environ.get("SCORE_AMBER_THRESHOLD", 0.35))
+SCORE_RED_THRESHOLD = float(os.environ.get("SCORE_RED_THRESHOLD", 0.7))
+SCORE_CANCEL_AMBER_RATIO = float(os.environ.get("SCORE_CANCEL_AMBER_RATIO", 0.25))
+SCORE_CANCEL_RED_RATIO = float(os.environ.get("SCORE_CANCEL_RED_RATIO", 0.5))
+MAX_SEVERITY = 5.0
+
+@dataclass(frozen=True)
+class ScoringConfig:
+    severity_weight: float = SCORE_SEVERITY_WEIGHT
+    delay_weight: float = SCORE_DELAY_WEIGHT
+    delay_cap: float = SCORE_DELAY_CAP
+    amber_threshold: float = SCORE_AMBER_THRESHOLD
+    red_threshold: float = SCORE_RED_THRESHOLD
+    cancel_amber_ratio: float = SCORE_CANCEL_AMBER_RATIO
+    cancel_red_ratio: float = SCORE_CANCEL_RED_RATIO
+
+config = ScoringConfig()
+
+def with_overrides(**overrides):
+    # The live configuration with any non-None fields replaced (for what-if runs)
+    names = {f.name for f in fields(ScoringConfig)}
+    return replace(config, **{k: v for k, v in overrides.items() if k in names and v is not None})
+
+class Scores(NamedTuple):
+    stress_index: list
+    hub_status: list
+
+    def tolist(self):
+        # Plain Python lists; much cheaper than iterating NumPy arrays element by element
+        return Scores(*(column.tolist() if hasattr(column, "tolist") else list(column) for column in self))
+
+def score_station(avg_severity, avg_delay, cancelled, total_trains, cfg=None):
+    # (score, status) for one station; total_trains=None (unknown) skips the cancellation override
+    cfg = cfg or config
+    # Score Algorithm (0.0 - 1.0)
+    score = (avg_severity / MAX_SEVERITY * cfg.severity_weight) + (min(avg_delay, cfg.delay_cap) / cfg.delay_cap * cfg.delay_weight)
+
+    # Determine Status Band
+    status = "GREEN"
+    if score > cfg.red_threshold: status = "RED"
+    elif score > cfg.amber_threshold: status = "AMBER"
+
+    # Domain Override
+    if total_trains is None:
+        return score, status
+    # The larger ratio first, or the red override could never fire
+    if cancelled > (total_trains * cfg.cancel_red_ratio):
+        status = "RED"
+        score = max(score, cfg.red_threshold)
+    elif cancelled > (total_trains * cfg.cancel_amber_ratio):
+        status = "AMBER"
+        score = max(score, cfg.amber_threshold)
+    return score, status
+
+def score_batch(avg_severity, avg_delay, cancelled, total_trains, cfg=None):
+    # Column-wise score_station: equal-length sequences in, Scores of arrays (or lists without NumPy) out
+    cfg = cfg or config
+    if np is None:
+        pairs = [score_station(*row, cfg) for row in zip(avg_severity, avg_delay, cancelled, total_trains)]
+        return Scores([p[0] for p in pairs], [p[1] for p in pairs])
+
+    severity = np.asarray(avg_severity, dtype=float)
+    delay = np.asarray(avg_delay, dtype=float)
+    cancelled = np.asarray(cancelled, dtype=float)
+    # None -> NaN, and NaN comparisons are False, so unknown totals never trigger the override
+    total = np.asarray(total_trains, dtype=float)
+
+    scores = (severity / MAX_SEVERITY * cfg.severity_weight) + (np.minimum(delay, cfg.delay_cap) / cfg.delay_cap * cfg.delay_weight)
+    statuses = np.where(scores > cfg.red_threshold, "RED", np.where(scores > cfg.amber_threshold, "AMBER", "GREEN")).astype(object)
+
+    red = cancelled > total * cfg.cancel_red_ratio
+    amber = ~red & (cancelled > total * cfg.cancel_amber_ratio)
+    statuses[red] = "RED"
+    statuses[amber] = "AMBER"
+    scores = np.where(amber, np.maximum(scores, cfg.amber_threshold), scores)
+    scores = np.where(red, np.maximum(scores, cfg.red_threshold), scores)
+    return Scores(scores, statuses)
@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Optional dependency: redis-py, only needed for redis:// stores
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Shared Cache Configuration: empty keeps every worker on its own in-memory board cache
+SHARED_CACHE_URL = os.environ.get("SHARED_CACHE_URL", "")
+SHARED_CACHE_PREFIX = os.environ.get("SHARED_CACHE_PREFIX", "railpulse:")
+# Longest a fetch lock is held (a crashed holder frees it after this), and how often waiters re-check
+SHARED_CACHE_LOCK_TTL = float(os.environ.get("SHARED_CACHE_LOCK_TTL", 10))
+SHARED_CACHE_POLL = float(os.environ.get("SHARED_CACHE_POLL", 0.05))
+
+def gcra(tat, now, interval, burst, cost=1):
+    # Token bucket as a single timestamp (GCRA): tat is when the bucket will next be full.
+    # Returns (new tat, 0) when `cost` tokens are available, else (old tat, seconds until they are)
+    new_tat = max(tat or now, now) + interval * cost
+    overshoot = new_tat - now - interval * burst
+    if overshoot > 0:
+        return tat, overshoot
+    return new_tat, 0.0
+
+# Stores hold bytes with a TTL. add() is set-if-absent and delete_if() is compare-and-delete,
+# which is all the fleet-wide fetch lock needs; take() is an atomic token-bucket draw for rate limits.
+class MemoryStore:
+    # Process-local; the reference backend for tests and single-worker runs
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+        self._sweep_at = 1024
+
+    def get(self, key):
+        with self._lock:
+            item = self._values.get(key)
+            if item is None or item[1] <= time.monotonic():
+                return None
+            return item[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + ttl)
+
+    def add(self, key, value, ttl):
+        now = time.monotonic()
+        with self._lock:
+            item = self._values.get(key)
+            if item is not None and item[1] > now:
+                return False
+            self._values[key] = (value, now + ttl)
+            return True
+
+    def delete_if(self, key, value):
+        with self._lock:
+            item = self._values.get(key)
+            if item is not None and item[0] == value:
+                del self._values[key]
+
+    def take(self, key, now, interval, burst, cost=1):
+        # Seconds to wait for the tokens (0 = granted); rate-limit keys are per client, so sweep as they grow
+        mono = time.monotonic()
+        with self._lock:
+            if len(self._values) >= self._sweep_at:
+                self._values = {k: v for k, v in self._values.items() if v[1] > mono}
+                self._sweep_at = max(1024, 2 * len(self._values))
+            item = self._values.get(key)
+            tat = item[0] if item is not None and item[1] > mono else None
+            tat, retry_after = gcra(tat, now, interval, burst, cost)
+            if not retry_after:
+                self._values[key] = (tat, mono + (tat - now))
+            return retry_after
+
+    def close(self):
+        with self._lock:
+            self._values.clear()
+
+class SQLiteStore:
+    # One file shared by every worker on a host; WAL lets readers run alongside the single writer
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._conn()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_cache "
+                "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM shared_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        conn = self._conn()
+        # The table holds one row per station plus its lock, so sweeping on write stays cheap
+        conn.execute("DELETE FROM shared_cache WHERE expires_at <= ?", (now,))
+        conn.execute("INSERT OR REPLACE INTO shared_cache VALUES (?, ?, ?)", (key, value, now + ttl))
+
+    def add(self, key, value, ttl):
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO shared_cache VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE "
+            "SET value = excluded.value, expires_at = excluded.expires_at WHERE shared_cache.expires_at <= ?",
+            (key, value, now + ttl, now),
+        )
+        return cursor.rowcount == 1
+
+    def delete_if(self, key, value):
+        self._conn().execute("DELETE FROM shared_cache WHERE key = ? AND value = ?", (key, value))
+
+    def take(self, key, now, interval, burst, cost=1):
+        # BEGIN IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT value FROM shared_cache WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            tat, retry_after = gcra(float(row[0]) if row else None, now, interval, burst, cost)
+            if not retry_after:
+                conn.execute("INSERT OR REPLACE INTO shared_cache VALUES (?, ?, ?)", (key, repr(tat), tat))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return retry_after
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+class RedisStore:
+    # Anything speaking the Redis protocol (Redis, Valkey, KeyDB); `client` needs redis-py's get/set/eval
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+    # gcra() in Lua; the result is a string because Redis truncates Lua numbers to integers.
+    # %.17g round-trips a double: tostring() keeps 14 digits, which rounds epoch-scale tats up
+    _TAKE = """
+local now, interval, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local tat = math.max(tonumber(redis.call('get', KEYS[1]) or ARGV[1]), now) + interval * cost
+local overshoot = tat - now - interval * burst
+if overshoot > 0 then return string.format('%.17g', overshoot) end
+redis.call('set', KEYS[1], string.format('%.17g', tat), 'PX', math.ceil((tat - now) * 1000))
+return '0'
+"""
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        if redis is None:
+            raise RuntimeError("SHARED_CACHE_URL points at Redis but the redis package is not installed")
+        return cls(redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1))
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    def add(self, key, value, ttl):
+        return bool(self.client.set(key, value, nx=True, px=max(1, int(ttl * 1000))))
+
+    def delete_if(self, key, value):
+        self.client.eval(self._RELEASE, 1, key, value)
+
+    def take(self, key, now, interval, burst, cost=1):
+        return float(self.client.eval(self._TAKE, 1, key, repr(now), repr(interval), burst, cost))
+
+    def close(self):
+        self.client.close()
+
+def open_store(url):
+    # "" -> None (no shared layer), memory://, sqlite:///path/to/file, redis://host:port/db (or rediss://, unix://)
+    if not url:
+        return None
+    scheme = url.split("://", 1)[0].lower()
+    if scheme == "memory":
+        return MemoryStore()
+    if scheme == "sqlite":
+        return SQLiteStore(url.split("://", 1)[1].removeprefix("/") or "shared_cache.db")
+    if scheme in ("redis", "rediss", "unix"):
+        return RedisStore.from_url(url)
+    raise ValueError(f"Unsupported SHARED_CACHE_URL scheme: {scheme}")
+
+# Read-through cache over a shared store with a fleet-wide single-flight lock per key.
+# Store failures degrade to calling the loader directly; they never fail a request.
+class SharedCache:
+    def __init__(self, store=None, prefix=SHARED_CACHE_PREFIX, lock_ttl=SHARED_CACHE_LOCK_TTL,
+                 poll=SHARED_CACHE_POLL):
+        self.store = store
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl
+        self.poll = poll
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(("hits", "misses", "loads", "waits", "lock_timeouts", "errors"), 0)
+
+    @property
+    def enabled(self):
+        return self.store is not None
+
+    async def load_async(self, key, loader, encode, decode, ttl):
+        # The stored value if fresh; otherwise one caller across the fleet awaits loader() and the rest
+        # wait. Store calls run in a thread so the event loop never waits on I/O
+        value = await asyncio.to_thread(self._read, key, decode)
+        if value is not None:
+            return value
+        token = uuid.uuid4().hex.encode()
+        deadline = time.monotonic() + self.lock_ttl
+        while True:
+            # True: ours; None: the store is down, so fetch unlocked; False: someone else is fetching
+            acquired = await asyncio.to_thread(self._call, self.store.add, self._lock_key(key), token, self.lock_ttl)
+            if acquired is not False or time.monotonic() >= deadline:
+                if acquired is False:
+                    self._count("lock_timeouts")
+                try:
+                    value = await loader()
+                    await asyncio.to_thread(self._publish, key, value, encode, ttl)
+                    return value
+                finally:
+                    if acquired:
+                        await asyncio.to_thread(self._release, key, token)
+            await asyncio.sleep(self.poll)
+            value = await asyncio.to_thread(self._read, key, decode, False)
+            if value is not None:
+                self._count("waits")
+                return value
+
+    def stats(self):
+        with self._lock:
+            return {"backend": type(self.store).__name__ if self.store else None, **self._counters}
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+    def _lock_key(self, key):
+        return f"{self.prefix}lock:{key}"
+
+    def _read(self, key, decode, count=True):
+        raw = self._call(self.store.get, self.prefix + key)
+        value = None
+        if raw is not None:
+            try:
+                value = decode(raw)
+            except ValueError as e:
+                self._count("errors")
+                logger.warning("Shared cache entry %s unreadable, reloading: %r", key, e)
+        if count:
+            self._count("hits" if value is not None else "misses")
+        return value
+
+    def _publish(self, key, value, encode, ttl):
+        # Written before the lock is released so waiters find it on their next check
+        self._count("loads")
+        self._call(self.store.set, self.prefix + key, encode(value), ttl)
+
+    def _release(self, key, token):
+        self._call(self.store.delete_if, self._lock_key(key), token)
+
+    def _call(self, method, *args):
+        # None on a store error: readers treat it as a miss, lockers as "fetch without the lock"
+        try:
+            return method(*args)
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Shared cache %s failed: %r", method.__name__, e)
+            return None
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+cache = SharedCache(open_store(SHARED_CACHE_URL))
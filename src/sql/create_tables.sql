@@ -22,9 +22,38 @@ CREATE TABLE incidents (
     severity INTEGER NOT NULL, -- 1 to 5
     description TEXT,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    station_code VARCHAR(10) DEFAULT 'LDS',
 
     CONSTRAINT fk_user
       FOREIGN KEY(owner_id) 
       REFERENCES users(id)
       ON DELETE CASCADE
-);
\ No newline at end of file
+);
+
+-- Hub health window: reports for one station in the last hour
+CREATE INDEX ix_incidents_station_created ON incidents (station_code, created_at);
+
+-- My-reports keyset pages: (owner_id, created_at, id) walked in index order
+CREATE INDEX IF NOT EXISTS ix_incidents_owner_created ON incidents (owner_id, created_at, id);
+
+-- Hub health history: append-only samples, range-partitioned by month
+CREATE TABLE hub_health_snapshots (
+    id BIGSERIAL,
+    station_code VARCHAR(10) NOT NULL,
+    sampled_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    stress_index DOUBLE PRECISION,
+    hub_status VARCHAR(10),
+    cancellations INTEGER,
+    total_trains INTEGER, -- upgrading an older table: ALTER TABLE hub_health_snapshots ADD COLUMN total_trains INTEGER;
+    avg_delay DOUBLE PRECISION,
+    passenger_reports INTEGER,
+    avg_report_severity DOUBLE PRECISION,
+    PRIMARY KEY (id, sampled_at)
+) PARTITION BY RANGE (sampled_at);
+
+-- Monthly partitions (hub_health_snapshots_YYYY_MM) are created a month ahead by the
+-- health sampler; the DEFAULT partition catches any row that arrives before its month exists
+CREATE TABLE hub_health_snapshots_default PARTITION OF hub_health_snapshots DEFAULT;
+
+CREATE INDEX ix_snapshots_station_sampled ON hub_health_snapshots (station_code, sampled_at);
+CREATE INDEX ix_snapshots_sampled_brin ON hub_health_snapshots USING BRIN (sampled_at);
@@ -0,0 +1,51 @@
+import random
+
+from fastapi.testclient import TestClient
+
+from src import rail_service
+from benchmarks import fake_huxley, micro, report
+
+
+def test_fake_board_parses():
+    """Generated boards go through the real parser with the requested shape."""
+    raw = fake_huxley.make_board("LDS", trains=200, cancel_ratio=0.1, delay_ratio=0.3, rng=random.Random(7))
+    board = rail_service.parse_board(raw, "LDS")
+    assert len(board.trains) == 200
+    assert 5 < board.cancelled < 40
+    assert any(t.status == "Delayed" for t in board.trains)
+
+def test_fake_huxley_server():
+    """Boards are stable within a refresh period and error_rate=1 always fails."""
+    config = fake_huxley.FakeConfig(latency=0, jitter=0, trains=20)
+    client = TestClient(fake_huxley.create_app(config))
+    first = client.get("/all/LDS/50").json()
+    assert len(first["trainServices"]) == 20
+    assert client.get("/all/LDS/50").json() == first
+
+    config.error_rate = 1.0
+    assert client.get("/all/LDS/50").status_code == 503
+
+def test_report_percentiles():
+    """Nearest-rank percentiles in milliseconds, with throughput when elapsed time is known."""
+    summary = report.summarise([i / 1000 for i in range(1, 101)], errors=2, elapsed=2.0)
+    assert summary["p50_ms"] == 50
+    assert summary["p99_ms"] == 99
+    assert summary["errors"] == 2
+    assert summary["throughput_rps"] == 50
+    assert report.summarise([])["p95_ms"] is None
+
+def test_report_compare_flags_regressions():
+    """Slower latencies and lower throughput beyond the threshold are regressions."""
+    baseline = {"results": {"sqlite": {"health": {"p95_ms": 10.0, "throughput_rps": 100.0}}}}
+    candidate = {"results": {"sqlite": {"health": {"p95_ms": 10.5, "throughput_rps": 80.0}}}}
+    _, regressions = report.compare(baseline, candidate, threshold=0.1)
+    assert [(name, key) for name, key, *_ in regressions] == [("sqlite/health", "throughput_rps")]
+
+def test_micro_benchmarks_run():
+    """The micro-benchmark suite runs end to end and reports every measurement."""
+    results = micro.run(sizes=(10,), min_time=0.001)
+    assert set(results) == {"trains_10", "board_cache_hit", "incident_window_stats", "score_batch_month"}
+    assert set(results["trains_10"]) == {
+        "parse_board", "board_from_trains", "compute_hub_health", "departures_dicts", "render_departures", "render_health",
+    }
+    assert all(r["per_call_us"] > 0 for r in (results["board_cache_hit"], results["incident_window_stats"]))
@@ -1,4 +1,17 @@
 import uuid
+import asyncio
+import random
+import time
+import httpx
+import pytest
+from datetime import datetime, timedelta
+from fastapi import FastAPI, HTTPException
+from sqlalchemy import event
+from fastapi.testclient import TestClient
+from src import rail_service, auth, models, fast_json, database, metrics, scoring, incident_queue, delay_stats, rate_limit, incident_window, hub_health, shared_cache
+from src.incident_window import IncidentWindow
+from src.health_history import HealthSampler
+from src import health_stream
 
 # Global test data
 test_data = {
@@ -26,6 +39,20 @@ def create_test_incident(client, headers, station="LDS"):
     })
     return res.json()["id"]
 
+@pytest.fixture
+def fake_huxley(monkeypatch):
+    """Replace the upstream fetch with canned boards; stations in `down` raise."""
+    boards, down = {}, set()
+    async def fake_fetch(station):
+        if station in down:
+            raise httpx.ConnectError("Huxley down")
+        return boards.get(station, rail_service.Board.from_trains(f"Station {station}", ()))
+    monkeypatch.setattr(rail_service, "fetch_board_async", fake_fetch)
+    rail_service.board_cache.clear()
+    rail_service.breaker.clear()
+    yield boards, down
+    rail_service.board_cache.clear()
+    rail_service.breaker.clear()
 
 
 def test_register_user_a(client):
@@ -195,4 +222,675 @@ def test_validation_missing_fields(client):
         "type": "Crowding"
         # Missing severity entirely
     })
-    assert response.status_code == 422
\ No newline at end of file
+    assert response.status_code == 422
+
+def test_batch_health(client, fake_huxley):
+    """Batch endpoint scores every station in one response with grouped report counts."""
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    create_test_incident(client, headers, station="MAN")
+    create_test_incident(client, headers, station="MAN")
+
+    response = client.get("/analytics/health?stations=MAN,YRK,MAN")
+    assert response.status_code == 200
+    results = {r["station_code"]: r for r in response.json()["results"]}
+    assert list(results) == ["MAN", "YRK"]
+    assert results["MAN"]["metrics"]["passenger_reports"] == 2
+    assert results["YRK"]["metrics"]["passenger_reports"] == 0
+
+def test_batch_health_reports_station_errors(client, fake_huxley):
+    """One failing upstream board is reported without failing the batch."""
+    boards, down = fake_huxley
+    down.add("YRK")
+    response = client.post("/analytics/health", json={"stations": ["LDS", "YRK"]})
+    assert response.status_code == 200
+    assert [r["station_code"] for r in response.json()["results"]] == ["LDS"]
+    assert response.json()["errors"][0]["station_code"] == "YRK"
+
+def test_hub_health_report_aggregates(client, fake_huxley):
+    """Report count and average severity come back from the aggregate query."""
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    create_test_incident(client, headers, station="MAN")
+    client.post("/incidents", headers=headers, json={"station_code": "MAN", "type": "Delay", "severity": 1})
+
+    metrics = client.get("/analytics/MAN/health").json()["metrics"]
+    assert metrics["passenger_reports"] == 2
+    assert metrics["avg_report_severity"] == 2.5
+
+def test_hub_health_follows_incident_writes(client, fake_huxley, monkeypatch):
+    """Updates and deletes are reflected in the rolling window behind hub health."""
+    monkeypatch.setattr(incident_window, "WINDOW_ENABLED", True)
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    incident_id = create_test_incident(client, headers, station="MAN")
+    assert client.get("/analytics/MAN/health").json()["metrics"]["avg_report_severity"] == 4
+
+    client.put(f"/incidents/{incident_id}", headers=headers, json={"severity": 2})
+    assert client.get("/analytics/MAN/health").json()["metrics"]["avg_report_severity"] == 2
+
+    client.delete(f"/incidents/{incident_id}", headers=headers)
+    assert client.get("/analytics/MAN/health").json()["metrics"]["passenger_reports"] == 0
+
+def test_incident_window_expiry():
+    """Reports older than the window drop out without a rescan."""
+    window = IncidentWindow(minutes=60)
+    now = datetime.now()
+    window.seed([
+        ("old", "LDS", now - timedelta(minutes=90), 5),
+        ("new", "LDS", now - timedelta(minutes=5), 3),
+    ])
+    assert window.stats("LDS", now=now.timestamp()) == (1, 3.0)
+    assert window.stats("YRK", now=now.timestamp()) == (0, 0.0)
+
+def test_incident_window_expires_on_write():
+    """Stations nobody reads stay bounded: writes expire old buckets and skip stale reports."""
+    window = IncidentWindow(minutes=60)
+    now = datetime.now()
+    window.record("LDS", "old", now - timedelta(minutes=30), 4, now=(now - timedelta(minutes=45)).timestamp())
+    for i in range(1000):
+        window.record("LDS", i, now - timedelta(hours=5), 2, now=now.timestamp())
+    station = window._stations["LDS"]
+    assert station.count == 1 and len(station.members) == 1
+
+def test_incident_window_disabled_records_nothing(client, fake_huxley):
+    """With the window off (the default), writes leave it empty."""
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    create_test_incident(client, headers, station="MAN")
+    assert incident_window.window._stations == {}
+
+def test_current_user_cached(client, db_session):
+    """Verified principals are cached until invalidated, skipping the user lookup."""
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    assert client.get("/incidents/my-reports", headers=headers).status_code == 200
+
+    # Deactivate behind the API's back: the cached principal still serves...
+    user = db_session.query(models.User).filter(models.User.email == test_data["email_a"]).first()
+    user.is_active = False
+    db_session.commit()
+    assert client.get("/incidents/my-reports", headers=headers).status_code == 200
+
+    # ...until the user is explicitly invalidated
+    auth.invalidate_user(test_data["email_a"])
+    assert client.get("/incidents/my-reports", headers=headers).status_code == 401
+
+def test_current_user_from_token_claims(client, db_session, monkeypatch):
+    """With trusted claims the principal comes straight from the token."""
+    monkeypatch.setattr(auth, "AUTH_TRUST_TOKEN_CLAIMS", True)
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    auth.principal_cache.clear()
+    db_session.query(models.User).delete()
+    db_session.commit()
+    assert client.get("/incidents/my-reports", headers=headers).status_code == 200
+
+def test_password_pool_sheds_when_full():
+    """Password work beyond the worker + queue budget is rejected with a 503."""
+    pool = auth.PasswordPool(workers=1, queue_limit=1)
+    async def burst():
+        return await asyncio.gather(*(pool.run(time.sleep, 0.1) for _ in range(3)), return_exceptions=True)
+    results = asyncio.run(burst())
+    rejected = [r for r in results if isinstance(r, HTTPException)]
+    assert len(rejected) == 1
+    assert rejected[0].status_code == 503
+    assert rejected[0].headers["Retry-After"] == "1"
+    assert pool.stats()["completed"] == 2
+    assert pool.stats()["wait_seconds"] > 0
+
+def test_my_reports_keyset_pagination(client):
+    """Cursor pages walk every report exactly once, newest first."""
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    created = {create_test_incident(client, headers) for _ in range(5)}
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/incidents/my-reports", headers=headers, params=params)
+        assert response.status_code == 200
+        seen += [r["id"] for r in response.json()]
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert pages == 3
+    assert len(seen) == 5 and set(seen) == created
+
+def test_my_reports_ndjson_stream(client):
+    """NDJSON mode streams one report per line."""
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    for _ in range(3):
+        create_test_incident(client, headers)
+    response = client.get("/incidents/my-reports", headers=headers, params={"format": "ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = response.text.strip().split("\n")
+    assert len(lines) == 3
+
+def test_bulk_create_incidents(client):
+    """Bulk upload inserts valid reports and reports per-item errors."""
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    response = client.post("/incidents/bulk", headers=headers, json=[
+        {"station_code": "MAN", "type": "Crowding", "severity": 4},
+        {"type": "Crowding"},
+        {"station_code": "YRK", "type": "Delay", "severity": 2},
+    ])
+    assert response.status_code == 201
+    body = response.json()
+    assert [i["station_code"] for i in body["created"]] == ["MAN", "YRK"]
+    assert body["errors"][0]["index"] == 1
+    assert "severity" in body["errors"][0]["detail"]
+    assert len(client.get("/incidents/my-reports", headers=headers).json()) == 2
+
+def test_bulk_create_incidents_ndjson(client):
+    """NDJSON uploads are accepted line by line."""
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    lines = "\n".join(['{"type": "Crowding", "severity": 3}', 'not json', '{"type": "Delay", "severity": 1}'])
+    response = client.post("/incidents/bulk", content=lines,
+                           headers={**headers, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 201
+    assert len(response.json()["created"]) == 2
+    assert response.json()["errors"][0]["index"] == 1
+
+def test_bulk_create_incidents_ndjson_rejects_bad_encoding(client):
+    """An NDJSON body that isn't UTF-8 is a client error, not a crash."""
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    response = client.post("/incidents/bulk", content=b"\xff\xfe{}",
+                           headers={**headers, "Content-Type": "application/x-ndjson"})
+    assert response.status_code == 400
+
+def test_health_sampler_writes_snapshots(client, db_session, async_session_factory, fake_huxley):
+    """A sampling round scores each station and stores one snapshot per hub."""
+    sampler = HealthSampler(["LDS", "MAN"], session_factory=async_session_factory)
+    rows = asyncio.run(sampler.sample_once())
+    assert [r["station_code"] for r in rows] == ["LDS", "MAN"]
+    assert db_session.query(models.HubHealthSnapshot).count() == 2
+
+def test_health_sampler_one_worker_per_round():
+    """Samplers sharing a store split rounds: each round is claimed by exactly one worker."""
+    store = shared_cache.MemoryStore()
+    workers = [HealthSampler(["LDS"], store=store) for _ in range(3)]
+    claims = [asyncio.run(w.claim_round(100)) for w in workers]
+    assert claims == [True, False, False]
+    assert asyncio.run(workers[1].claim_round(101)) is True
+
+def test_write_behind_incident_accepted_then_flushed(client, db_session, async_session_factory, monkeypatch):
+    """With write-behind on, reports are acknowledged with 202 and land in one group commit."""
+    writer = incident_queue.IncidentWriter(session_factory=async_session_factory, max_queue=2)
+    monkeypatch.setattr(incident_queue, "WRITE_BEHIND", True)
+    monkeypatch.setattr(incident_queue, "writer", writer)
+    monkeypatch.setattr(incident_window, "WINDOW_ENABLED", True)
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+
+    first = client.post("/incidents", headers=headers, json={"station_code": "MAN", "type": "Crowding", "severity": 3})
+    assert first.status_code == 202
+    client.post("/incidents", headers=headers, json={"station_code": "MAN", "type": "Crowding", "severity": 5})
+    full = client.post("/incidents", headers=headers, json={"station_code": "MAN", "type": "Crowding", "severity": 1})
+    assert full.status_code == 503
+    # Counted in hub health before the commit
+    assert client.get("/analytics/MAN/health").json()["metrics"]["passenger_reports"] == 2
+
+    asyncio.run(writer.flush())
+    assert db_session.query(models.Incident).count() == 2
+    assert db_session.get(models.Incident, uuid.UUID(first.json()["id"])).severity == 3
+    assert writer.stats()["batches"] == 1
+
+def test_write_behind_spills_and_replays(db_session, async_session_factory, tmp_path):
+    """Reports the database rejects go to the spill file and are replayed once it recovers."""
+    class Unavailable:
+        async def __aenter__(self):
+            raise ConnectionRefusedError("database down")
+        async def __aexit__(self, *exc):
+            return False
+
+    spill = tmp_path / "incidents.spill"
+    writer = incident_queue.IncidentWriter(session_factory=Unavailable, spill_path=str(spill), fsync=False)
+    owner = models.User(email=f"spill_{uuid.uuid4().hex[:8]}@railpulse.com", hashed_password="x")
+    db_session.add(owner)
+    db_session.commit()
+    for severity in (1, 2, 3):
+        writer.submit({"id": uuid.uuid4(), "owner_id": owner.id, "created_at": datetime.now(), "station_code": "LDS",
+                       "train_id": None, "type": "Delay", "severity": severity, "description": None})
+
+    asyncio.run(writer.flush())
+    assert len(spill.read_text().splitlines()) == 3
+    assert writer.stats()["queued"] == 0
+
+    writer.session_factory = async_session_factory
+    asyncio.run(writer.flush())
+    assert not spill.exists()
+    assert sorted(i.severity for i in db_session.query(models.Incident)) == [1, 2, 3]
+
+def test_write_behind_dead_letters_refused_rows(db_session, async_session_factory, tmp_path):
+    """A row the database refuses is dead-lettered alone; the rest of its batch is written and nothing is spilled."""
+    def foreign_keys(connection, record):
+        connection.execute("PRAGMA foreign_keys=ON")
+    engine = async_session_factory.kw["bind"].sync_engine
+    event.listen(engine, "connect", foreign_keys)
+    try:
+        spill, dead = tmp_path / "incidents.spill", tmp_path / "incidents.dead"
+        writer = incident_queue.IncidentWriter(session_factory=async_session_factory, spill_path=str(spill),
+                                               dead_letter_path=str(dead), fsync=False)
+        owner = models.User(email=f"dead_{uuid.uuid4().hex[:8]}@railpulse.com", hashed_password="x")
+        db_session.add(owner)
+        db_session.commit()
+        for owner_id in (owner.id, uuid.uuid4(), owner.id):
+            writer.submit({"id": uuid.uuid4(), "owner_id": owner_id, "created_at": datetime.now(), "station_code": "LDS",
+                           "train_id": None, "type": "Delay", "severity": 2, "description": None})
+
+        asyncio.run(writer.flush())
+        assert db_session.query(models.Incident).count() == 2
+        assert writer.stats()["dead_lettered"] == 1 and writer.stats()["queued"] == 0
+        assert len(dead.read_text().splitlines()) == 1
+        assert not spill.exists()
+    finally:
+        event.remove(engine, "connect", foreign_keys)
+
+def test_write_behind_stop_keeps_batch_in_flight(db_session, async_session_factory, tmp_path):
+    """Stopping while a batch is being written loses nothing: every report is written or spilled."""
+    class SlowWriter(incident_queue.IncidentWriter):
+        async def _write(self, rows):
+            await asyncio.sleep(0.2)
+            await super()._write(rows)
+
+    spill = tmp_path / "incidents.spill"
+    writer = SlowWriter(session_factory=async_session_factory, flush_size=2, flush_interval=0.01,
+                        spill_path=str(spill), fsync=False)
+    owner = models.User(email=f"stop_{uuid.uuid4().hex[:8]}@railpulse.com", hashed_password="x")
+    db_session.add(owner)
+    db_session.commit()
+    for severity in (1, 2, 3, 4, 5):
+        writer.submit({"id": uuid.uuid4(), "owner_id": owner.id, "created_at": datetime.now(), "station_code": "LDS",
+                       "train_id": None, "type": "Delay", "severity": severity, "description": None})
+
+    async def stop_mid_write():
+        await writer.start()
+        await asyncio.sleep(0.05)
+        await writer.stop()
+
+    asyncio.run(stop_mid_write())
+    stats = writer.stats()
+    assert stats["queued"] == 0
+    assert stats["written"] + stats["spilled"] == stats["accepted"] == 5
+    assert db_session.query(models.Incident).filter_by(owner_id=owner.id).count() == stats["written"]
+
+def test_write_behind_replay_is_idempotent(db_session, async_session_factory, tmp_path):
+    """Replaying a spill file whose rows were already committed skips them instead of jamming."""
+    owner = models.User(email=f"replay_{uuid.uuid4().hex[:8]}@railpulse.com", hashed_password="x")
+    db_session.add(owner)
+    db_session.commit()
+    rows = [{"id": uuid.uuid4(), "owner_id": owner.id, "created_at": datetime.now(), "station_code": "LDS",
+             "train_id": None, "type": "Delay", "severity": severity, "description": None} for severity in (1, 2)]
+    spill = tmp_path / "incidents.spill"
+    spill.write_text("".join(incident_queue._encode_row(row) + "\n" for row in rows))
+    writer = incident_queue.IncidentWriter(session_factory=async_session_factory, spill_path=str(spill), fsync=False)
+    # As if the previous replay committed the first row and crashed before removing the file
+    asyncio.run(writer._write(rows[:1]))
+
+    asyncio.run(writer.flush())
+    assert not spill.exists()
+    assert sorted(i.severity for i in db_session.query(models.Incident)) == [1, 2]
+
+def test_delay_distribution_endpoints(client, fake_huxley, monkeypatch):
+    """Station delays come back per operator, and the network view merges every tracked station."""
+    boards, down = fake_huxley
+    monkeypatch.setattr(delay_stats, "stats", delay_stats.DelayStats())
+    services = [
+        {"serviceId": f"S{i}", "origin": [{"crs": "YRK", "locationName": "York"}], "sta": "10:00",
+         "eta": "12:00" if i < 2 else "10:03", "operator": "LNER" if i % 2 else "Northern"}
+        for i in range(40)
+    ]
+    boards["LDS"] = rail_service.parse_board({"locationName": "Leeds", "trainServices": services}, "LDS")
+
+    station = client.get("/analytics/LDS/delays").json()
+    assert station["samples"] == 40
+    # Two 120-minute outliers move the tail, not the median
+    assert station["p50_minutes"] == 3
+    assert station["p99_minutes"] >= 100
+    assert station["histogram"]["120+"] == 2
+    assert station["operators"]["LNER"]["samples"] == 20
+
+    client.get("/analytics/MAN/delays")
+    network = client.get("/analytics/delays", params={"window": "15m"}).json()
+    assert sorted(network["stations"]) == ["LDS", "MAN"]
+    assert network["network"]["samples"] == 40
+    assert client.get("/analytics/delays", params={"window": "30d"}).status_code == 400
+
+def test_rate_limits_login_and_upstream_reads(client, fake_huxley, monkeypatch):
+    """Logins and board cache misses spend their own budgets and answer 429 with Retry-After."""
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limit, "limiter", rate_limit.RateLimiter(budgets={
+        "default": (1, 100), "login": (60, 2), "upstream": (60, 1),
+    }))
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    form = {"username": test_data["email_a"], "password": test_data["password_a"]}
+    limited = client.post("/users/login", data=form)
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) >= 1
+
+    assert client.get("/analytics/LDS/health", headers=headers).status_code == 200
+    # Cached board: no upstream budget spent
+    assert client.get("/live/departures/LDS", headers=headers).status_code == 200
+    assert client.get("/analytics/MAN/health", headers=headers).status_code == 429
+
+def test_rate_limit_charges_batch_health_per_cache_miss(client, fake_huxley, monkeypatch):
+    """Batch health spends one upstream token per station not in the board cache, at most a full bucket."""
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limit, "limiter", rate_limit.RateLimiter(budgets={
+        "default": (1, 100), "upstream": (60, 3),
+    }))
+    assert client.get("/analytics/health", params={"stations": "LDS,MAN"}).status_code == 200
+    # LDS and MAN are cached now; only YRK costs a token
+    assert client.post("/analytics/health", json={"stations": ["LDS", "MAN", "YRK"]}).status_code == 200
+    assert client.get("/analytics/health", params={"stations": "KGX"}).status_code == 429
+
+    monkeypatch.setattr(rate_limit, "limiter", rate_limit.RateLimiter(budgets={
+        "default": (1, 100), "upstream": (60, 3),
+    }))
+    assert client.get("/analytics/health", params={"stations": "EDB,NCL,BHM,LIV,SHF"}).status_code == 200
+    assert client.get("/analytics/health", params={"stations": "GLC"}).status_code == 429
+
+def test_rate_limit_middleware_default_budget(monkeypatch):
+    """The default budget applies to every route before routing, except the metrics scrape."""
+    app = FastAPI()
+    app.get("/ping")(lambda: {"ok": True})
+    app.get("/metrics")(lambda: {"ok": True})
+    monkeypatch.setattr(rate_limit, "limiter", rate_limit.RateLimiter(budgets={"default": (60, 2)}))
+    client = TestClient(rate_limit.RateLimitMiddleware(app))
+
+    assert [client.get("/ping").status_code for _ in range(3)] == [200, 200, 429]
+    assert client.get("/metrics").status_code == 200
+
+def test_upstream_inflight_cap_sheds_load(client, fake_huxley, monkeypatch):
+    """At the in-flight cap, cached stations degrade to their last board and unknown ones get 503."""
+    monkeypatch.setattr(rail_service.board_cache, "ttl", 0)
+    monkeypatch.setattr(rail_service.board_cache, "stale_ttl", 0)
+    client.get("/analytics/LDS/health")
+    slots = rail_service.UpstreamSlots(limit=1)
+    assert slots.acquire()
+    monkeypatch.setattr(rail_service, "upstream_slots", slots)
+
+    assert client.get("/analytics/LDS/health").json()["degraded"] is True
+    busy = client.get("/analytics/KGX/health")
+    assert busy.status_code == 503
+    assert busy.headers["Retry-After"] == str(rail_service.HUXLEY_BUSY_RETRY_AFTER)
+    assert slots.stats()["rejected"] == 2
+
+def test_hub_history_downsamples(client, db_session):
+    """History is bucketed in SQL and the bucket widens to bound the payload."""
+    base = datetime(2026, 3, 2, 7, 0, 0)
+    for minute, score in [(0, 0.2), (1, 0.4), (2, 0.6), (7, 0.8)]:
+        db_session.add(models.HubHealthSnapshot(
+            station_code="LDS", sampled_at=base + timedelta(minutes=minute), stress_index=score,
+            hub_status="GREEN", cancellations=minute, avg_delay=1.0, passenger_reports=0, avg_report_severity=0
+        ))
+    db_session.commit()
+
+    response = client.get("/analytics/LDS/history", params={
+        "from": "2026-03-02T07:00:00", "to": "2026-03-02T09:00:00", "bucket": "5m"
+    })
+    assert response.status_code == 200
+    points = response.json()["points"]
+    assert [p["samples"] for p in points] == [3, 1]
+    assert points[0]["avg_stress_index"] == 0.4
+    assert points[0]["bucket_start"].startswith("2026-03-02T07:00")
+    assert points[1]["bucket_start"].startswith("2026-03-02T07:05")
+
+    month = client.get("/analytics/LDS/history", params={
+        "from": "2026-03-01T00:00:00", "to": "2026-04-01T00:00:00", "bucket": "1m"
+    }).json()
+    assert month["bucket_seconds"] >= 31 * 86400 / 500
+
+def test_websocket_health_stream(client, async_session_factory, fake_huxley, monkeypatch):
+    """Subscribers receive the shared health payload; extra connections are refused."""
+    monkeypatch.setattr(health_stream.hub, "session_factory", async_session_factory)
+    monkeypatch.setattr(health_stream.hub, "max_subscribers", 1)
+    with client.websocket_connect("/analytics/LDS/ws") as ws:
+        payload = ws.receive_json()
+        assert payload["station_code"] == "LDS"
+        assert "hub_status" in payload
+        with pytest.raises(Exception):
+            with client.websocket_connect("/analytics/LDS/ws") as second:
+                second.receive_json()
+
+def test_health_stream_normalises_and_caps_feeds(client, monkeypatch):
+    """Station codes share one feed regardless of case, junk codes are refused and feeds are capped."""
+    hub = health_stream.HealthHub(max_feeds=1)
+    monkeypatch.setattr(health_stream, "hub", hub)
+    monkeypatch.setattr(health_stream.StationFeed, "start", lambda self: None)
+    assert health_stream.normalise_station(" lds") == "LDS"
+    hub.open(health_stream.normalise_station("lds"))
+    hub.open(health_stream.normalise_station("LDS"))
+    assert list(hub.feeds) == ["LDS"] and len(hub.feeds["LDS"].subscribers) == 2
+    with pytest.raises(health_stream.StreamFull):
+        hub.open("MAN")
+    assert client.get("/analytics/not-a-station/stream").status_code == 400
+    assert client.get("/analytics/MAN/stream").status_code == 503
+
+def test_station_feed_pushes_only_changes():
+    """Unchanged health is not re-sent and slow consumers only keep the newest payload."""
+    feed = health_stream.StationFeed("LDS", compute=None, interval=1)
+    queue = asyncio.Queue(maxsize=1)
+    feed.subscribers.add(queue)
+    def payload(score):
+        return {"stress_index": score, "hub_status": "GREEN", "metrics": {"cancellations": 0}, "timestamp": datetime.now()}
+    assert feed.publish(payload(0.1)) is True
+    assert feed.publish(payload(0.1)) is False
+    assert feed.publish(payload(0.2)) is True
+    assert queue.qsize() == 1
+    assert queue.get_nowait()["stress_index"] == 0.2
+    assert feed.dropped == 1
+
+def test_live_departures_conditional(client, fake_huxley):
+    """Departures carry a board ETag and answer If-None-Match with 304."""
+    response = client.get("/live/departures/LDS")
+    etag = response.headers["ETag"]
+    assert "max-age" in response.headers["Cache-Control"]
+
+    cached = client.get("/live/departures/LDS", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+def test_hub_health_etag_tracks_reports(client, fake_huxley):
+    """The health ETag changes when the incident window changes."""
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    first = client.get("/analytics/MAN/health")
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+    assert client.get("/analytics/MAN/health", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/analytics/MAN/health", headers={"If-None-Match": etag[2:]}).status_code == 304
+
+    create_test_incident(client, headers, station="MAN")
+    changed = client.get("/analytics/MAN/health", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+def test_failed_board_not_cacheable(client, fake_huxley):
+    """A failed upstream fetch is served as no-store without an ETag."""
+    boards, down = fake_huxley
+    down.add("KGX")
+    response = client.get("/live/departures/KGX")
+    assert response.headers["Cache-Control"] == "no-store"
+    assert "ETag" not in response.headers
+
+def test_health_serves_last_known_good_when_upstream_fails(client, fake_huxley, monkeypatch):
+    """A failing station falls back to its last board, flagged degraded with its age."""
+    boards, down = fake_huxley
+    fresh = client.get("/analytics/LDS/health").json()
+    assert fresh["degraded"] is False
+    assert fresh["data_age_seconds"] is not None
+
+    # Every read goes upstream, and upstream is down
+    monkeypatch.setattr(rail_service.board_cache, "ttl", 0)
+    monkeypatch.setattr(rail_service.board_cache, "stale_ttl", 0)
+    down.add("LDS")
+    response = client.get("/analytics/LDS/health")
+    assert response.json()["degraded"] is True
+    assert response.json()["hub_status"] == "GREEN"
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert response.headers["X-Data-Degraded"] == "true"
+    assert client.get("/live/departures/LDS").headers["X-Data-Degraded"] == "true"
+
+    down.add("KGX")
+    unknown = client.get("/analytics/KGX/health").json()
+    assert unknown["hub_status"] == "UNKNOWN"
+    assert unknown["data_age_seconds"] is None
+
+def test_fast_json_matches_standard_path(client, fake_huxley, monkeypatch):
+    """The opt-in fast path serves the same JSON from bytes cached per snapshot."""
+    boards, down = fake_huxley
+    boards["LDS"] = rail_service.parse_board({"locationName": "Leeds", "trainServices": [
+        {"origin": [{"crs": "YRK", "locationName": "York"}], "sta": "10:00", "eta": "10:20", "operator": "LNER"},
+    ]}, "LDS")
+    standard = client.get("/live/departures/LDS").json()
+    standard_health = client.get("/analytics/LDS/health").json()
+
+    monkeypatch.setattr(fast_json, "FAST_JSON", True)
+    fast = client.get("/live/departures/LDS")
+    assert fast.headers["content-type"] == "application/json"
+    assert fast.json() == standard
+    assert fast.headers["ETag"]
+    fast_health = client.get("/analytics/LDS/health").json()
+    # Both are stamped per response
+    for payload in (standard_health, fast_health):
+        assert payload.pop("timestamp") and payload.pop("data_age_seconds") is not None
+    assert fast_health == standard_health
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_memoised_health_restamps_freshness(client, fake_huxley, monkeypatch, fast):
+    """The memoised body is reused, but the timestamp and data age are current on every response."""
+    boards, down = fake_huxley
+    monkeypatch.setattr(fast_json, "FAST_JSON", fast)
+    boards["LDS"] = rail_service.Board.from_trains("Leeds", (), fetched_at=time.time() - 120)
+    first = client.get("/analytics/LDS/health").json()
+    # Same content (same ETag), fetched longer ago
+    rail_service.board_cache.clear()
+    boards["LDS"] = rail_service.Board.from_trains("Leeds", (), fetched_at=time.time() - 300)
+    second = client.get("/analytics/LDS/health").json()
+    assert 120 <= first["data_age_seconds"] < 200
+    assert second["data_age_seconds"] >= 300
+    assert second["timestamp"] != first["timestamp"]
+
+def test_async_url_maps_drivers(monkeypatch):
+    """Sync URLs map onto their async drivers unless ASYNC_DATABASE_URL is set."""
+    monkeypatch.delenv("ASYNC_DATABASE_URL", raising=False)
+    url = database.async_url("postgresql://u:p@db/railpulse?sslmode=require")
+    assert url.drivername == "postgresql+asyncpg"
+    assert url.query == {"ssl": "require"}
+    assert database.async_url("sqlite:///./local.db").drivername == "sqlite+aiosqlite"
+    monkeypatch.setenv("ASYNC_DATABASE_URL", "postgresql+asyncpg://u:p@replica/railpulse")
+    assert database.async_url("postgresql://u:p@db/railpulse").host == "replica"
+
+def test_status_reports_pools(client):
+    """The status endpoint exposes pool and cache counters for monitoring."""
+    body = client.get("/status").json()
+    assert set(body["database"]) == {"sync", "async", "replica_routing"}
+    assert "hits" in body["board_cache"]
+    assert "pending" in body["password_pool"]
+
+def test_replica_router_falls_back_when_stale(async_session_factory, monkeypatch):
+    """Reads go to the replica while its lag is within bounds, otherwise to the primary."""
+    router = database.ReplicaRouter(async_session_factory.kw["bind"], max_staleness=5, check_interval=0)
+    lag = {"seconds": 0.0}
+    async def measure_lag():
+        if lag["seconds"] is None:
+            raise ConnectionError("replica down")
+        return lag["seconds"]
+    monkeypatch.setattr(router, "measure_lag", measure_lag)
+
+    assert asyncio.run(router.use_replica()) is True
+    lag["seconds"] = 30.0
+    assert asyncio.run(router.use_replica()) is False
+    lag["seconds"] = None
+    assert asyncio.run(router.use_replica()) is False
+    assert router.stats()["replica_reads"] == 1
+    assert router.stats()["primary_reads"] == 2
+
+def test_reads_served_from_replica(client, async_session_factory, fake_huxley, monkeypatch):
+    """With a replica configured, health and listings read from it while writes hit the primary."""
+    router = database.ReplicaRouter(async_session_factory.kw["bind"], check_interval=0)
+    monkeypatch.setattr(database, "replica", router)
+    client.app.dependency_overrides.pop(database.get_read_db)
+
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    create_test_incident(client, headers)
+
+    assert len(client.get("/incidents/my-reports", headers=headers).json()) == 1
+    assert client.get("/analytics/LDS/health").json()["metrics"]["passenger_reports"] == 1
+    assert router.replica_reads == 2
+
+def test_metrics_endpoint(client, fake_huxley):
+    """Requests, upstream failures, bcrypt and DB query times show up on /metrics."""
+    metrics.registry.clear()
+    _, down = fake_huxley
+    down.add("KGX")
+    headers = setup_user(client, test_data["email_a"], test_data["password_a"])
+    create_test_incident(client, headers)
+    client.get("/analytics/LDS/health")
+    client.get("/analytics/KGX/health")
+
+    body = client.get("/metrics").text
+    assert 'railpulse_http_request_duration_seconds_count{method="GET",route="/analytics/{station_code}/health",status="200"} 2' in body
+    assert 'railpulse_upstream_errors_total{station="KGX",error="ConnectError"}' in body
+    assert 'railpulse_upstream_fallbacks_total{station="KGX"}' in body
+    assert 'railpulse_health_stage_duration_seconds_count{stage="scoring"}' in body
+    assert 'railpulse_db_query_duration_seconds_count{query="create_incident"} 1' in body
+    assert 'railpulse_bcrypt_duration_seconds_count{operation="verify_password"} 1' in body
+    assert 'railpulse_auth_lookups_total{source="db"} 1' in body
+
+def test_histogram_folds_excess_series(monkeypatch):
+    """Label sets beyond METRICS_MAX_SERIES are folded into 'other' so junk input can't grow memory."""
+    monkeypatch.setattr(metrics, "METRICS_MAX_SERIES", 2)
+    histogram = metrics.Histogram("test_seconds", "Test.", ("station",), buckets=(0.1, 1.0))
+    for station, value in (("LDS", 0.05), ("MAN", 0.5), ("ZZ1", 2.0), ("ZZ2", 0.05)):
+        histogram.observe(value, station)
+
+    assert histogram.count("other") == 2
+    lines = histogram.render()
+    assert 'test_seconds_bucket{station="MAN",le="0.1"} 0' in lines
+    assert 'test_seconds_bucket{station="MAN",le="1.0"} 1' in lines
+    assert 'test_seconds_bucket{station="other",le="+Inf"} 2' in lines
+
+def test_scoring_batch_matches_single(monkeypatch):
+    """The vectorised and plain-Python batch paths agree with scoring one station at a time."""
+    rng = random.Random(3)
+    rows = [(rng.uniform(0, 5), rng.uniform(0, 90), rng.randint(0, 20), rng.choice([None, 0, 10, 40])) for _ in range(500)]
+    expected = [scoring.score_station(*row) for row in rows]
+    columns = [list(c) for c in zip(*rows)]
+
+    assert list(zip(*scoring.score_batch(*columns).tolist())) == expected
+    monkeypatch.setattr(scoring, "np", None)
+    assert list(zip(*scoring.score_batch(*columns).tolist())) == expected
+
+def test_scoring_bands_and_override():
+    """Default weights reproduce the published bands and the cancellation override."""
+    assert scoring.score_station(5, 60, 0, 10) == (1.0, "RED")
+    assert scoring.score_station(0, 30, 0, 10) == (0.3, "GREEN")
+    assert scoring.score_station(0, 0, 3, 10) == (0.35, "AMBER")
+    assert scoring.score_station(0, 0, 6, 10) == (0.7, "RED")
+    assert scoring.score_batch([0], [0], [6], [10]).tolist() == ([0.7], ["RED"])
+    assert scoring.score_station(0, 0, 3, None) == (0.0, "GREEN")
+    assert scoring.with_overrides(delay_weight=1.0).delay_weight == 1.0
+
+def test_what_if_rescore(client, db_session, async_session_factory):
+    """Stored snapshots are rescored under new weights; only the backfill writes them back."""
+    base = datetime(2026, 3, 2, 7, 0, 0)
+    for minute, delay in enumerate([0.0, 30.0, 60.0]):
+        score, status = scoring.score_station(0, delay, 0, 10)
+        db_session.add(models.HubHealthSnapshot(
+            station_code="LDS", sampled_at=base + timedelta(minutes=minute), stress_index=round(score, 2),
+            hub_status=status, cancellations=0, total_trains=10, avg_delay=delay, passenger_reports=0, avg_report_severity=0
+        ))
+    db_session.commit()
+
+    body = {"from": "2026-03-02T00:00:00", "to": "2026-03-03T00:00:00", "stations": ["lds"], "delay_weight": 1.0}
+    summary = client.post("/analytics/rescore", json=body).json()
+    assert summary["rows"] == 3
+    assert summary["changed"] == 2
+    assert summary["status_counts"] == {"GREEN": 1, "AMBER": 1, "RED": 1}
+    assert summary["previous_status_counts"] == {"GREEN": 2, "AMBER": 1}
+    assert summary["written"] is False
+
+    async def backfill():
+        async with async_session_factory() as db:
+            return await hub_health.rescore_snapshots(
+                db, base, base + timedelta(hours=1), cfg=scoring.with_overrides(delay_weight=1.0), write=True
+            )
+    assert asyncio.run(backfill())["written"] is True
+    db_session.expire_all()
+    assert sorted(s.stress_index for s in db_session.query(models.HubHealthSnapshot)) == [0.0, 0.5, 1.0]
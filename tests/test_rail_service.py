@@ -0,0 +1,371 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import uuid
+
+import httpx
+import pytest
+
+from src import auth, rail_service, shared_cache, delay_stats, rate_limit
+from src.board_poller import BoardPoller
+
+# --- HELPER FUNCTIONS ---
+def make_loader(result=None, delay=0.0):
+    """Loader that counts upstream calls and optionally sleeps to simulate Huxley."""
+    calls = []
+    async def loader(key):
+        calls.append(key)
+        await asyncio.sleep(delay)
+        return result if result is not None else {"station_name": key, "trains": []}
+    return loader, calls
+
+def read(cache, loader, *keys):
+    """Read each key in turn through the cache on one event loop."""
+    async def run():
+        return [await cache.get_async(key, loader) for key in keys]
+    return asyncio.run(run())
+
+
+def test_board_cache_hit_within_ttl():
+    """Second read inside the TTL is served without another upstream call."""
+    cache = rail_service.BoardCache(ttl=60, stale_ttl=0, max_entries=10)
+    loader, calls = make_loader()
+    read(cache, loader, "LDS", "LDS")
+    assert calls == ["LDS"]
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_board_cache_stale_while_revalidate():
+    """Expired boards are served immediately while one background refresh runs."""
+    cache = rail_service.BoardCache(ttl=0.05, stale_ttl=60, max_entries=10)
+    loader, calls = make_loader(delay=0.1)
+    async def run():
+        first = await cache.get_async("LDS", loader)
+        await asyncio.sleep(0.1)
+        assert await cache.get_async("LDS", loader) is first
+        assert await cache.get_async("LDS", loader) is first
+        await asyncio.sleep(0.3)
+    asyncio.run(run())
+    assert calls == ["LDS", "LDS"]
+    assert cache.stats()["refreshes"] == 1
+
+def test_board_cache_lru_eviction():
+    """The least recently used station is evicted when the bound is reached."""
+    cache = rail_service.BoardCache(ttl=60, stale_ttl=0, max_entries=2)
+    loader, calls = make_loader()
+    read(cache, loader, "LDS", "MAN", "LDS", "YRK", "LDS", "MAN")
+    assert calls == ["LDS", "MAN", "YRK", "MAN"]
+    assert cache.stats()["evictions"] == 2
+
+def test_board_cache_errors_not_cached():
+    """Failed upstream fetches are not stored, so the next call retries."""
+    cache = rail_service.BoardCache(ttl=60, stale_ttl=0, max_entries=10)
+    calls = []
+    async def failing(key):
+        calls.append(key)
+        raise ConnectionError("Huxley down")
+    for _ in range(2):
+        try:
+            read(cache, failing, "LDS")
+        except ConnectionError:
+            pass
+    assert len(calls) == 2
+
+def test_circuit_breaker_opens_and_probes(monkeypatch):
+    """Repeated failures open the circuit; after the reset timeout one probe may close it."""
+    breaker = rail_service.CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    monkeypatch.setattr(rail_service, "breaker", breaker)
+    calls = []
+    async def fetch(hub_code):
+        calls.append(hub_code)
+        raise ConnectionError("Huxley down")
+    monkeypatch.setattr(rail_service, "fetch_board_async", fetch)
+
+    for _ in range(3):
+        try:
+            asyncio.run(rail_service.load_upstream_async("LDS"))
+        except (ConnectionError, rail_service.CircuitOpen):
+            pass
+    # The third call failed fast without reaching upstream
+    assert calls == ["LDS", "LDS"]
+    assert breaker.state("LDS") == "open"
+    assert breaker.allow("MAN")
+
+    clock = time.monotonic()
+    monkeypatch.setattr(rail_service.time, "monotonic", lambda: clock + 11)
+    assert breaker.allow("LDS")
+    assert not breaker.allow("LDS")  # only one probe at a time
+    breaker.record_success("LDS")
+    assert breaker.state("LDS") == "closed"
+
+class FakeRedis:
+    """Just enough of redis-py for RedisStore flows; eval is emulated, so the Lua scripts are tested separately."""
+    def __init__(self):
+        self.data = shared_cache.MemoryStore()
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, px=None):
+        if nx:
+            return self.data.add(key, value, px / 1000) or None
+        self.data.set(key, value, px / 1000)
+        return True
+
+    def eval(self, script, numkeys, key, *args):
+        if script == shared_cache.RedisStore._TAKE:
+            now, interval, burst, cost = args
+            return str(self.data.take(key, float(now), float(interval), int(burst), int(cost)))
+        self.data.delete_if(key, *args)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def redis_client():
+    """A real Redis at REDIS_TEST_URL, else fakeredis with Lua scripting; skipped when neither is available."""
+    url = os.environ.get("REDIS_TEST_URL")
+    if url:
+        redis = pytest.importorskip("redis")
+        client = redis.Redis.from_url(url)
+        try:
+            client.ping()
+        except redis.ConnectionError:
+            pytest.skip(f"No Redis at {url}")
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        pytest.importorskip("lupa")
+        client = fakeredis.FakeRedis()
+    yield client
+    client.close()
+
+def test_redis_lock_release_script(redis_client):
+    """The compare-and-delete script only frees a lock still holding the caller's token."""
+    store = shared_cache.RedisStore(redis_client)
+    key = f"test:lock:{uuid.uuid4().hex}"
+    assert store.add(key, b"mine", 10)
+    assert not store.add(key, b"theirs", 10)
+    store.delete_if(key, b"theirs")
+    assert store.get(key) == b"mine"
+    store.delete_if(key, b"mine")
+    assert store.get(key) is None
+
+def test_redis_take_script_matches_gcra(redis_client):
+    """The Lua token bucket grants the burst, then returns fractional waits and expires with the bucket."""
+    store = shared_cache.RedisStore(redis_client)
+    key = f"test:bucket:{uuid.uuid4().hex}"
+    now = time.time()
+    assert [store.take(key, now, 20.0, 3) for _ in range(3)] == [0, 0, 0]
+    retry_after = store.take(key, now + 0.5, 20.0, 3)
+    assert retry_after == pytest.approx(shared_cache.gcra(now + 60, now + 0.5, 20.0, 3)[1])
+    assert retry_after % 1
+    assert store.take(key, now + 20, 20.0, 3) == 0
+    assert store.take(key, now + 60, 20.0, 3, cost=2) == 0
+    assert store.take(key, now + 60, 20.0, 3, cost=2) == pytest.approx(40.0)
+    assert 0 < redis_client.pttl(key) <= 60000
+
+def test_shared_cache_fetches_once_across_workers(tmp_path):
+    """Two workers on one SQLite file: concurrent misses make a single upstream call."""
+    store_path = str(tmp_path / "shared.db")
+    workers = [shared_cache.SharedCache(shared_cache.SQLiteStore(store_path), poll=0.01) for _ in range(2)]
+    calls = []
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return {"station_name": "LDS"}
+
+    # Separate threads (and event loops) stand in for separate worker processes
+    results = []
+    def worker(cache):
+        results.append(asyncio.run(cache.load_async("board:LDS", loader, lambda v: repr(v).encode(), lambda b: b, 30)))
+    threads = [threading.Thread(target=worker, args=(w,)) for w in workers for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert len(results) == 6
+    # Everyone else either waited on the lock or arrived after the value was published
+    assert sum(w.stats()["waits"] + w.stats()["hits"] for w in workers) == 5
+
+def test_shared_board_cache_over_redis(monkeypatch):
+    """Boards round-trip through a Redis-protocol store, and a store outage falls back to upstream."""
+    redis = FakeRedis()
+    monkeypatch.setattr(shared_cache, "cache", shared_cache.SharedCache(shared_cache.RedisStore(redis)))
+    board = rail_service.parse_board({"locationName": "Leeds", "trainServices": [
+        {"origin": [{"crs": "YRK", "locationName": "York"}], "sta": "10:00", "eta": "10:20", "operator": "LNER"},
+    ]}, "LDS")
+    calls = []
+    async def fake_fetch(station):
+        calls.append(station)
+        return board
+    monkeypatch.setattr(rail_service, "fetch_board_async", fake_fetch)
+
+    # Two workers, each with its own in-process cache
+    first = asyncio.run(rail_service.BoardCache().get_async("LDS", rail_service.load_board_async))
+    second = asyncio.run(rail_service.BoardCache().get_async("LDS", rail_service.load_board_async))
+    assert calls == ["LDS"]
+    assert second == first == board
+    assert redis.get("railpulse:lock:board:LDS") is None
+
+    def down(*args, **kwargs):
+        raise ConnectionError("Redis down")
+    monkeypatch.setattr(redis, "get", down)
+    monkeypatch.setattr(redis, "set", down)
+    assert asyncio.run(rail_service.load_board_async("LDS")) == board
+    assert calls == ["LDS", "LDS"]
+
+def test_board_cache_async_single_flight():
+    """Concurrent async misses share one upstream task."""
+    cache = rail_service.BoardCache(ttl=60, stale_ttl=0, max_entries=10)
+    calls = []
+    async def loader(key):
+        calls.append(key)
+        await asyncio.sleep(0.1)
+        return {"station_name": key, "trains": []}
+    async def burst():
+        return await asyncio.gather(*(cache.get_async("LDS", loader) for _ in range(20)))
+    results = asyncio.run(burst())
+    assert calls == ["LDS"]
+    assert all(r is results[0] for r in results)
+
+def test_fetch_board_async_retries_upstream_errors(monkeypatch):
+    """Transient 5xx responses are retried with backoff before succeeding."""
+    attempts = []
+    def handler(request):
+        attempts.append(request.url.path)
+        if len(attempts) < 3:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"locationName": "Leeds", "trainServices": []})
+    monkeypatch.setattr(rail_service, "HUXLEY_RETRY_BACKOFF", 0)
+    async def run():
+        monkeypatch.setattr(rail_service, "_async_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        try:
+            return await rail_service.fetch_board_async("LDS")
+        finally:
+            await rail_service.close_client()
+    board = asyncio.run(run())
+    assert board.station_name == "Leeds"
+    assert len(attempts) == 3
+
+def test_board_poller_publishes_snapshots(monkeypatch):
+    """Polled stations are written into the cache so reads never go upstream."""
+    async def fake_fetch(station):
+        return rail_service.Board.from_trains(f"Station {station}", ())
+    monkeypatch.setattr(rail_service, "fetch_board_async", fake_fetch)
+    cache = rail_service.BoardCache(ttl=60, stale_ttl=0, max_entries=10)
+    poller = BoardPoller(["LDS", "man"], interval=0.05, jitter=0, cache=cache)
+    async def run():
+        await poller.start()
+        await asyncio.sleep(0.1)
+        await poller.stop()
+    asyncio.run(run())
+    loader, calls = make_loader()
+    assert read(cache, loader, "MAN")[0].station_name == "Station MAN"
+    assert calls == []
+
+def test_board_poller_backs_off_on_failure(monkeypatch):
+    """Repeated upstream failures stretch the poll interval instead of hammering Huxley."""
+    attempts = []
+    async def failing_fetch(station):
+        attempts.append(time.monotonic())
+        raise httpx.ConnectError("Huxley down")
+    monkeypatch.setattr(rail_service, "fetch_board_async", failing_fetch)
+    poller = BoardPoller(["LDS"], interval=0.02, jitter=0, max_backoff=10,
+                         cache=rail_service.BoardCache(ttl=60, stale_ttl=0, max_entries=10))
+    async def run():
+        await poller.start()
+        await asyncio.sleep(0.3)
+        await poller.stop()
+    asyncio.run(run())
+    # 0.02 * (2 + 4 + 8) = 0.28s covers at most four attempts; without backoff it would be ~15
+    assert 2 <= len(attempts) <= 4
+    assert poller.status()["LDS"]["failures"] == len(attempts)
+
+def test_parse_board_delays_and_aggregates():
+    """Delays use minute arithmetic (wrapping midnight) and the board carries health aggregates."""
+    board = rail_service.parse_board({"locationName": "Leeds", "trainServices": [
+        {"origin": [{"crs": "YRK", "locationName": "York"}], "sta": "23:55", "eta": "00:10", "operator": "LNER"},
+        {"std": "10:00", "etd": "On time", "operator": "Northern"},
+        {"sta": "10:05", "eta": "Cancelled", "operator": "TPE"},
+        {"sta": "10:10", "eta": "Delayed", "operator": "XC"},
+    ]}, "LDS")
+    delays = [t.delay_weight for t in board.trains]
+    assert delays == [15, 0, 60, 0]
+    assert [t.status for t in board.trains] == ["Delayed", "On Time", "Cancelled", "On Time"]
+    assert board.cancelled == 1
+    assert board.avg_delay == 5
+    first = board.departures()[0]
+    assert first["refund_eligible"] is True
+    assert first["origin_city"] == "York"
+    assert board.departures()[1]["from_code"] == "UNK"
+
+def test_delay_sketch_quantiles_and_merge():
+    """Sketch quantiles stay within the relative accuracy, and merged sketches match one built from all values."""
+    rng = random.Random(3)
+    values = [rng.choice([0, 0, 0, rng.randint(1, 15), rng.randint(20, 180)]) for _ in range(5000)]
+    halves = delay_stats.DelaySketch(), delay_stats.DelaySketch()
+    whole = delay_stats.DelaySketch()
+    for i, value in enumerate(values):
+        halves[i % 2].add(value)
+        whole.add(value)
+    merged = halves[0].merge(halves[1])
+    ranked = sorted(values)
+    for q in (0.5, 0.9, 0.99):
+        exact = ranked[int(q * (len(ranked) - 1))]
+        assert merged.quantile(q) == whole.quantile(q)
+        assert abs(merged.quantile(q) - exact) <= exact * delay_stats.DELAY_RELATIVE_ACCURACY + 1e-9
+    assert sum(merged.histogram) == len(values)
+
+def test_delay_stats_counts_each_service_once_per_bucket():
+    """Refreshing a board replaces a service's delay instead of adding it again; cancellations are kept apart."""
+    def board(delay):
+        return rail_service.parse_board({"locationName": "Leeds", "trainServices": [
+            {"serviceId": "A", "origin": [{"crs": "YRK", "locationName": "York"}], "sta": "10:00", "eta": delay, "operator": "LNER"},
+            {"serviceId": "B", "origin": [{"crs": "MAN", "locationName": "Manchester"}], "sta": "10:05", "eta": "Cancelled", "operator": "Northern"},
+        ]}, "LDS")
+    stats = delay_stats.DelayStats(bucket_seconds=300)
+    now = 1_000_000
+    stats.record_board("LDS", board("10:30"), now)
+    stats.record_board("LDS", board("10:30"), now + 1)
+    stats.record_board("LDS", board("10:10"), now + 2)
+
+    summary = stats.summary(["LDS"], 3600, now + 3)
+    station = summary["stations"]["LDS"]
+    assert station["samples"] == 1
+    assert station["cancelled"] == 1
+    assert abs(station["p50_minutes"] - 10) <= 10 * delay_stats.DELAY_RELATIVE_ACCURACY
+    assert station["histogram"]["5-14"] == 1
+    assert station["operators"]["Northern"]["cancelled"] == 1
+    assert summary["network"]["samples"] == 1
+
+def test_rate_limits_shared_across_workers(tmp_path):
+    """Workers sharing a store draw from one token bucket per client; other clients are unaffected."""
+    budgets = {"login": (60, 3)}
+    stores = [shared_cache.SQLiteStore(str(tmp_path / "limits.db")) for _ in range(2)]
+    workers = [rate_limit.RateLimiter(store, budgets) for store in stores]
+    results = [workers[i % 2].take("login", "ip:10.0.0.1") for i in range(4)]
+    assert results[:3] == [0, 0, 0]
+    assert 59 < results[3] <= 60
+    assert workers[1].take("login", "ip:10.0.0.2") == 0
+
+    redis = rate_limit.RateLimiter(shared_cache.RedisStore(FakeRedis()), budgets)
+    assert [redis.take("login", "user:a") > 0 for _ in range(4)] == [False, False, False, True]
+
+def test_rate_limit_budget_parsing():
+    """Budgets parse as requests/seconds; zero or negative parts are rejected with the usual message."""
+    assert rate_limit.parse_budget("10/60") == (6.0, 10)
+    for spec in ("0/60", "-5/60", "10/0", "ten/60", "10"):
+        with pytest.raises(ValueError, match="look like 10/60"):
+            rate_limit.parse_budget(spec)
+
+def test_rate_limit_keys_by_token_subject():
+    """Valid bearer tokens key by subject; anything else falls back to the client address."""
+    token = auth.create_access_token({"sub": "a@railpulse.com"})
+    scope = {"headers": [(b"authorization", f"Bearer {token}".encode())], "client": ("10.0.0.1", 1234)}
+    assert rate_limit.client_key(scope) == "user:a@railpulse.com"
+    scope["headers"] = [(b"authorization", b"Bearer forged")]
+    assert rate_limit.client_key(scope) == "ip:10.0.0.1"
+